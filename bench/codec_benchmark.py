@@ -0,0 +1,101 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Micro-benchmark for the bridge value codec.
+
+Compares the table driven codec with the previous isinstance chain for deep
+and wide structures, reporting encode/decode time per value.  Loads the
+codec module directly so PySide is not needed:
+
+    python bench/codec_benchmark.py
+"""
+import os
+import imp
+import json
+import timeit
+
+codec = imp.load_source('codec', os.path.join(
+    os.path.dirname(__file__), '..', 'python', 'photoshop', 'codec.py'))
+
+
+# the isinstance chains the codec replaced
+################################################################################
+def legacy_encode(v):
+    if v is None:
+        return {'type': 'null'}
+    if isinstance(v, str) or isinstance(v, unicode):
+        return {'type': 'String', 'value': v}
+    if isinstance(v, bool):
+        return {'type': 'Boolean', 'value': v}
+    if isinstance(v, int):
+        return {'type': 'int', 'value': v}
+    if isinstance(v, float):
+        return {'type': 'Number', 'value': v}
+    if isinstance(v, (list, tuple)):
+        return {'type': 'Array', 'value': [legacy_encode(e) for e in v]}
+    raise ValueError("Unhandled python object (%s) '%s'" % (type(v), v))
+
+
+def legacy_decode(d):
+    if d is None:
+        return None
+    if d['type'] in ['null', 'undefined']:
+        return None
+    if d['type'] in ['String', 'Number', 'Boolean', 'int', 'uint']:
+        return d['value']
+    if d['type'] == 'Array':
+        return [legacy_decode(e) for e in d['value']]
+    raise ValueError("Unknown reponse object '%s'" % d)
+
+
+# sample structures
+################################################################################
+def count_values(v):
+    if isinstance(v, (list, tuple)):
+        return 1 + sum(count_values(e) for e in v)
+    return 1
+
+
+def deep(depth):
+    value = [1, 2.5, 'leaf', True, None]
+    for _ in range(depth):
+        value = [value, 'level', 3]
+    return value
+
+
+def wide(width):
+    return [[i, i*0.5, 'layer %d' % i, i % 2 == 0] for i in range(width)]
+
+
+def run(name, value, number, legacy=True):
+    count = count_values(value)
+    encoded = codec.default.encode(value)
+    implementations = [('codec', codec.default.encode, codec.default.decode)]
+    if legacy:
+        implementations.insert(0, ('legacy', legacy_encode, legacy_decode))
+    results = []
+    for (label, encode, decode) in implementations:
+        encode_time = timeit.timeit(lambda: encode(value), number=number)
+        decode_time = timeit.timeit(lambda: decode(encoded), number=number)
+        results.append((label, encode_time, decode_time))
+    print "%s (%d values, %d bytes of json)" % (name, count, len(json.dumps(encoded)))
+    for (label, encode_time, decode_time) in results:
+        print "  %-8s encode %7.3f us/value   decode %7.3f us/value" % (
+            label,
+            encode_time*1e6/(count*number),
+            decode_time*1e6/(count*number))
+
+
+if __name__ == '__main__':
+    run('deep', deep(200), 200)
+    run('wide', wide(5000), 20)
+    codec.default.compact = True
+    run('wide (compact tags)', wide(5000), 20, legacy=False)
@@ -13,6 +13,8 @@ import sys
 import logging
 import logging.handlers
 
+import log_pipeline
+
 
 # platform specific alert with no dependencies
 def msgbox(msg):
@@ -32,10 +34,25 @@ try:
         os.makedirs(log_dir)
     rotating = logging.handlers.RotatingFileHandler(os.path.join(log_dir, 'tk-photoshop.log'), maxBytes=4*1024*1024, backupCount=10)
     rotating.setFormatter(logging.Formatter('%(asctime)s [%(levelname) 8s] %(threadName)s %(name)s: %(message)s'))
+
+    # loggers only enqueue, the pipeline thread formats and writes
+    g_logPipeline = log_pipeline.LogPipeline([rotating])
+    g_logPipeline.start()
+
     logger = logging.getLogger('sgtk')
-    logger.addHandler(rotating)
+    logger.addHandler(g_logPipeline.handler)
     logger.setLevel(logging.INFO)
 
+    # optional structured archive, see log_archive.py.  the log works
+    # without it, so a failure here must not stop the bootstrap
+    if os.getenv('SGTK_PHOTOSHOP_LOG_ARCHIVE') not in (None, '', '0'):
+        try:
+            import log_archive
+            g_logPipeline.add_target(log_archive.ArchiveHandler(log_archive.archive_dir()))
+        except Exception:
+            logging.getLogger('sgtk.photoshop.PythonBootstrap').exception(
+                "Could not open the log archive, continuing without it")
+
     logger = logging.getLogger('sgtk.photoshop.PythonBootstrap')
     logger.info('================================== Initializing Python Interpreter ===================================')
 
@@ -57,12 +74,15 @@ sys.path.insert(0, api_path)
 try:
     import photoshop
     import photoshop_extension_manager
+    # the heartbeat exits without atexit, write out the queued records first
+    photoshop.flexbase.add_exit_hook(g_logPipeline.stop)
     logger.debug(sys.argv)
     remote_port = int(sys.argv[1])
     heartbeat_port = int(sys.argv[2])
-    photoshop.initialize_photoshop_application(remote_port, heartbeat_port)
-    # if we made it here, tag the extension version
     bundle_version = sys.argv[3]
+    photoshop.initialize_photoshop_application(remote_port, heartbeat_port,
+        handshake=photoshop_extension_manager.supports_handshake(bundle_version))
+    # if we made it here, tag the extension version
     photoshop_extension_manager.tag(bundle_version)
 except Exception, e:
     msgbox("Shotgun Pipeline Toolkit failed to initialize photoshop api:\n\n%s" % e)
@@ -109,9 +129,9 @@ except Exception:
 try:
     g_log = logging_console.LogConsole()
     g_app.setProperty("tk-photoshop.log_console", g_log)
-    qt_handler = logging_console.QtLogHandler(g_log.logs)
+    qt_handler = logging_console.QtLogHandler(g_log)
+    g_logPipeline.add_target(qt_handler)
     logger = logging.getLogger('sgtk')
-    logger.addHandler(qt_handler)
     g_log.setHidden(True)
 except Exception, e:
     photoshop.set_message("Could not create logging console:\n\n%s" % e)
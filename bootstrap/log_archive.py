@@ -0,0 +1,402 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Structured log archive.
+
+Enabled by setting SGTK_PHOTOSHOP_LOG_ARCHIVE (to 1 for the default
+location, or to a directory).  Records are written as one JSON object per
+line into segments of SGTK_PHOTOSHOP_LOG_ARCHIVE_SEGMENT bytes:
+
+    {"t": 1386000000.25, "l": 40, "n": "sgtk.photoshop.flexbase",
+     "th": "MainThread", "m": "...", "x": "Traceback ..."}
+
+Full segments are gzipped by a background thread.  Each session keeps a
+small <session>.index.json next to its segments with the time range,
+record count and per level counts of every segment, so a session's slice
+can be pulled without reading or decompressing anything else:
+
+    python log_archive.py sessions
+    python log_archive.py slice <session> --level ERROR --since 10:30
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import glob
+import Queue
+import logging
+import threading
+
+ARCHIVE = 'SGTK_PHOTOSHOP_LOG_ARCHIVE'
+ARCHIVE_SEGMENT = 'SGTK_PHOTOSHOP_LOG_ARCHIVE_SEGMENT'
+ARCHIVE_KEEP = 'SGTK_PHOTOSHOP_LOG_ARCHIVE_KEEP'
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), 'Library', 'Logs', 'Shotgun', 'tk-photoshop-archive')
+DEFAULT_SEGMENT_BYTES = 4*1024*1024
+DEFAULT_KEEP_SESSIONS = 50
+
+INDEX_SUFFIX = '.index.json'
+
+
+def archive_dir():
+    """
+    Returns the archive directory, or None when archiving is disabled.
+    """
+    value = os.getenv(ARCHIVE)
+    if not value or value == '0':
+        return None
+    if value == '1':
+        return DEFAULT_DIR
+    return value
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _write_json(path, data):
+    # write then rename, readers never see a partial index
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    if sys.platform == 'win32' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+class ArchiveHandler(logging.Handler):
+    """
+    Log handler writing the archive segments of one session.  Meant to run
+    as a LogPipeline target, so writes stay off the logging threads.
+    """
+    def __init__(self, directory, segment_bytes=None, keep_sessions=None):
+        logging.Handler.__init__(self)
+        self.directory = directory
+        self.segment_bytes = segment_bytes or _env_int(ARCHIVE_SEGMENT, DEFAULT_SEGMENT_BYTES)
+        self.keep_sessions = keep_sessions or _env_int(ARCHIVE_KEEP, DEFAULT_KEEP_SESSIONS)
+        self.session = '%s-%d' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        self.index_path = os.path.join(directory, self.session + INDEX_SUFFIX)
+        self.index = {'session': self.session, 'pid': os.getpid(), 'segments': []}
+        self._stream = None
+        self._segment = None
+        self._formatter = logging.Formatter()
+        self._index_written = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._compress_queue = Queue.Queue()
+        self._compressor = threading.Thread(target=self._compress_run, name="LogArchiveCompressor")
+        self._compressor.daemon = True
+        self._compressor.start()
+
+        self._expire_sessions()
+        self._compress_leftovers()
+
+    # writing
+    ############################################################################
+    def emit(self, record):
+        try:
+            entry = {
+                't': round(record.created, 3),
+                'l': record.levelno,
+                'n': record.name,
+                'th': record.threadName,
+                'm': record.getMessage(),
+            }
+            if record.exc_info:
+                entry['x'] = self._formatter.formatException(record.exc_info)
+            line = json.dumps(entry, separators=(',', ':')) + '\n'
+
+            if self._stream is None:
+                self._open_segment()
+            self._stream.write(line)
+            segment = self._segment
+            segment['records'] += 1
+            segment['bytes'] += len(line)
+            segment['end'] = entry['t']
+            if segment['start'] is None:
+                segment['start'] = entry['t']
+            levels = segment['levels']
+            levels[str(record.levelno)] = levels.get(str(record.levelno), 0) + 1
+
+            if segment['bytes'] >= self.segment_bytes:
+                self._close_segment(compress=True)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self._stream is None:
+            return
+        self.acquire()
+        try:
+            self._stream.flush()
+            # keep the index reasonably current, it is what the slice tool reads
+            if time.time() - self._index_written > 1.0:
+                self._write_index()
+        finally:
+            self.release()
+
+    def close(self):
+        try:
+            self.acquire()
+            try:
+                if self._stream is not None:
+                    self._close_segment(compress=True)
+            finally:
+                self.release()
+            self._compress_queue.put(None)
+            self._compressor.join(10.0)
+        finally:
+            logging.Handler.close(self)
+
+    def _open_segment(self):
+        name = '%s-%03d.jsonl' % (self.session, len(self.index['segments']))
+        self._segment = {'file': name, 'start': None, 'end': None,
+            'records': 0, 'bytes': 0, 'levels': {}}
+        self.index['segments'].append(self._segment)
+        self._stream = open(os.path.join(self.directory, name), 'a')
+
+    def _close_segment(self, compress):
+        self._stream.close()
+        self._stream = None
+        self._write_index()
+        if compress:
+            self._compress_queue.put((self.index_path, self._segment['file']))
+        self._segment = None
+
+    def _write_index(self):
+        _write_json(self.index_path, self.index)
+        self._index_written = time.time()
+
+    # compression
+    ############################################################################
+    def _compress_run(self):
+        while True:
+            job = self._compress_queue.get()
+            if job is None:
+                return
+            (index_path, name) = job
+            try:
+                compressed = compress_segment(self.directory, name)
+                if compressed is None:
+                    continue
+                if index_path != self.index_path:
+                    _rename_segment(index_path, name, compressed)
+                    continue
+                self.acquire()
+                try:
+                    for segment in self.index['segments']:
+                        if segment['file'] == name:
+                            segment['file'] = compressed
+                    self._write_index()
+                finally:
+                    self.release()
+            except Exception:
+                # logging here would feed the archive its own errors
+                sys.stderr.write("Error compressing log segment %s\n" % (job, ))
+
+    def _compress_leftovers(self):
+        # segments of sessions that ended without compressing them.  the
+        # last segment of a session may belong to another running process,
+        # it is left as is
+        for index_path in glob.glob(os.path.join(self.directory, '*' + INDEX_SUFFIX)):
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+            except Exception:
+                continue
+            for segment in index.get('segments', ())[:-1]:
+                if not segment['file'].endswith('.gz'):
+                    self._compress_queue.put((index_path, segment['file']))
+
+    def _expire_sessions(self):
+        indexes = sorted(glob.glob(os.path.join(self.directory, '*' + INDEX_SUFFIX)))
+        for index_path in indexes[:max(0, len(indexes) - self.keep_sessions + 1)]:
+            session = os.path.basename(index_path)[:-len(INDEX_SUFFIX)]
+            for path in glob.glob(os.path.join(self.directory, session + '-*.jsonl*')):
+                os.remove(path)
+            os.remove(index_path)
+
+
+def compress_segment(directory, name):
+    """
+    Gzip a segment, returns the compressed file name or None when the
+    segment is gone.
+    """
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as src:
+        dst = gzip.open(path + '.gz', 'wb')
+        try:
+            while True:
+                data = src.read(65536)
+                if not data:
+                    break
+                dst.write(data)
+        finally:
+            dst.close()
+    os.remove(path)
+    return name + '.gz'
+
+
+def _rename_segment(index_path, name, compressed):
+    with open(index_path) as f:
+        index = json.load(f)
+    for segment in index['segments']:
+        if segment['file'] == name:
+            segment['file'] = compressed
+    _write_json(index_path, index)
+
+
+# reading
+################################################################################
+def load_indexes(directory):
+    indexes = []
+    for index_path in sorted(glob.glob(os.path.join(directory, '*' + INDEX_SUFFIX))):
+        try:
+            with open(index_path) as f:
+                indexes.append(json.load(f))
+        except Exception:
+            continue
+    return indexes
+
+
+def _open_segment_file(directory, name):
+    path = os.path.join(directory, name)
+    if not os.path.exists(path) and name.endswith('.gz'):
+        path = path[:-3]
+    elif not os.path.exists(path) and os.path.exists(path + '.gz'):
+        path = path + '.gz'
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_slice(directory, session, min_level=None, since=None, until=None, logger=None):
+    """
+    Yields the records (dicts) of a session matching the filters.  Segments
+    whose index entry rules them out are not opened.
+    """
+    for index in load_indexes(directory):
+        if index['session'] != session:
+            continue
+        for segment in index['segments']:
+            if segment['start'] is None:
+                continue
+            if since is not None and segment['end'] < since:
+                continue
+            if until is not None and segment['start'] > until:
+                continue
+            if min_level is not None and not [l for l in segment['levels'] if int(l) >= min_level]:
+                continue
+            f = _open_segment_file(directory, segment['file'])
+            try:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of a live segment may be partial
+                        continue
+                    if min_level is not None and entry['l'] < min_level:
+                        continue
+                    if since is not None and entry['t'] < since:
+                        continue
+                    if until is not None and entry['t'] > until:
+                        continue
+                    if logger and entry['n'] != logger and not entry['n'].startswith(logger + '.'):
+                        continue
+                    yield entry
+            finally:
+                f.close()
+
+
+def format_entry(entry):
+    text = '%s [%8s] %s %s: %s' % (
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['t'])),
+        logging.getLevelName(entry['l']), entry['th'], entry['n'], entry['m'])
+    if 'x' in entry:
+        text += '\n' + entry['x']
+    return text
+
+
+# command line
+################################################################################
+def _parse_time(value, session_day):
+    if value is None:
+        return None
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%H:%M:%S', '%H:%M'):
+        try:
+            parsed = time.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt.startswith('%H'):
+            # times of day are on the day the session started
+            parsed = time.strptime('%s %s' % (session_day, value), '%Y%m%d ' + fmt)
+        return time.mktime(parsed)
+    raise ValueError("unrecognized time '%s'" % value)
+
+
+def main(argv=None):
+    # only the command line needs argparse, it is not in python 2.6
+    import argparse
+    parser = argparse.ArgumentParser(description="Query the tk-photoshop structured log archive.")
+    parser.add_argument('--dir', default=archive_dir() or DEFAULT_DIR, help="archive directory")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('sessions', help="list the archived sessions")
+    slice_parser = commands.add_parser('slice', help="print the records of one session")
+    slice_parser.add_argument('session', help="session id, or 'last'")
+    slice_parser.add_argument('--level', help="minimum level name, e.g. ERROR")
+    slice_parser.add_argument('--since', help="HH:MM[:SS] or YYYY-MM-DD HH:MM[:SS]")
+    slice_parser.add_argument('--until', help="HH:MM[:SS] or YYYY-MM-DD HH:MM[:SS]")
+    slice_parser.add_argument('--logger', help="logger name, children included")
+    slice_parser.add_argument('--json', action='store_true', help="print raw JSON lines")
+    args = parser.parse_args(argv)
+
+    indexes = load_indexes(args.dir)
+    if args.command == 'sessions':
+        for index in indexes:
+            segments = [s for s in index['segments'] if s['start'] is not None]
+            levels = {}
+            for segment in segments:
+                for (level, count) in segment['levels'].iteritems():
+                    levels[level] = levels.get(level, 0) + count
+            print '%s  %s - %s  %6d records  %s' % (index['session'],
+                time.strftime('%H:%M:%S', time.localtime(segments[0]['start'])) if segments else '--',
+                time.strftime('%H:%M:%S', time.localtime(segments[-1]['end'])) if segments else '--',
+                sum(s['records'] for s in segments),
+                ' '.join('%s=%d' % (logging.getLevelName(int(l)), c) for (l, c) in sorted(levels.items())))
+        return 0
+
+    session = args.session
+    if session == 'last':
+        if not indexes:
+            parser.error("no archived sessions in %s" % args.dir)
+        session = indexes[-1]['session']
+    min_level = None
+    if args.level:
+        min_level = logging.getLevelName(args.level.upper())
+        if not isinstance(min_level, int):
+            parser.error("unknown level '%s'" % args.level)
+    day = session.split('-')[0]
+    for entry in read_slice(args.dir, session, min_level,
+            _parse_time(args.since, day), _parse_time(args.until, day), args.logger):
+        print json.dumps(entry) if args.json else format_entry(entry)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
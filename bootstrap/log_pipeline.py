@@ -0,0 +1,115 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Queue based logging.
+
+Loggers only get a QueueHandler, which puts the record on a queue and
+returns.  A single worker thread takes records off the queue in batches and
+hands them to the real handlers (the rotating log file, the log console),
+so formatting, charset decoding and disk writes never run on the network,
+heartbeat or gui threads that logged the record.
+"""
+import sys
+import Queue
+import atexit
+import logging
+import threading
+
+# records handled per batch before the targets are flushed
+BATCH_SIZE = 256
+
+_STOP = object()
+
+
+class QueueHandler(logging.Handler):
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        try:
+            # merge the arguments now, they may change once we return
+            record.msg = record.getMessage()
+            record.args = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class LogPipeline(object):
+    def __init__(self, targets=()):
+        self.queue = Queue.Queue()
+        self.handler = QueueHandler(self.queue)
+        self._targets = list(targets)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_target(self, handler):
+        with self._lock:
+            self._targets.append(handler)
+
+    def remove_target(self, handler):
+        with self._lock:
+            if handler in self._targets:
+                self._targets.remove(handler)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="LogPipeline")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        """
+        Write out everything queued so far and stop the worker.
+        """
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            stop = False
+            with self._lock:
+                targets = list(self._targets)
+            for record in batch:
+                if record is _STOP:
+                    stop = True
+                    continue
+                for target in targets:
+                    if record.levelno >= target.level:
+                        self._handle(target, record)
+            for target in targets:
+                try:
+                    target.flush()
+                except Exception:
+                    pass
+            if stop:
+                return
+
+    def _handle(self, target, record):
+        try:
+            target.handle(record)
+        except Exception:
+            # logging here would feed the pipeline its own errors
+            try:
+                sys.stderr.write("Error writing log record to %s\n" % target)
+            except Exception:
+                pass
@@ -18,6 +18,8 @@ CURRENT_EXTENSION = "1.1.0"
 CURRENT_ZXP_PATH = os.path.normpath(os.path.join(__file__, "..", "..", "SgTkPhotoshopEngine.zxp"))
 
 VERSION_BEFORE_RENAME = "0.1.2"
+# first extension that answers the startup handshake
+HANDSHAKE_EXTENSION = "1.2.0"
 EXTENSION_NAME = "Shotgun Photoshop Engine"
 
 ENV_VAR = "SGTK_PHOTOSHOP_EXTENSION_MANAGER"
@@ -160,6 +162,17 @@ def _get_win_fname():
     return os.path.join(folder, "%s_%s.ini" % (_APPNAME, version))
 
 
+def supports_handshake(version):
+    """
+    True if the extension of the given bundle version answers the startup
+    handshake, older ones would leave it to time out.
+    """
+    try:
+        return _version_cmp(version, HANDSHAKE_EXTENSION) >= 0
+    except ValueError:
+        return False
+
+
 def _version_cmp(left, right):
     def normalize(v):
         return [int(x) for x in re.sub(r'(\.0+)*$', '', v).split(".")]
@@ -31,17 +31,28 @@ class PhotoshopEngine(tank.platform.Engine):
         self._init_logging()
         self.log_debug("%s: Initializing...", self)
 
-        self.__qt_dialogs = []
-        
+        self._dialog_manager = None
+        self._dialog_warmer = None
+
 
     def post_app_init(self):
         import tk_photoshop
+        self._dialog_manager = tk_photoshop.DialogManager(self,
+            max_retained=self.get_setting("dialog_retention", 8),
+            reuse=self.get_setting("reuse_dialogs", False))
+        self._dialog_warmer = tk_photoshop.DialogWarmer(self, self._dialog_manager,
+            self.get_setting("warm_dialogs", 2))
         self._panel_generator = tk_photoshop.PanelGenerator(self)
         self._panel_generator.populate_panel()
 
+        # build the most used dialogs once startup has settled
+        self._dialog_warmer.start()
+
     def destroy_engine(self):
         self.log_debug("%s: Destroying...", self)
         self._panel_generator.destroy_panel()
+        if self._dialog_manager is not None:
+            self._dialog_manager.release_all()
 
     ##########################################################################################
     # UI
@@ -199,6 +210,21 @@ class PhotoshopEngine(tank.platform.Engine):
             
         return parent_widget
 
+    def _get_dialog_with_widget(self, title, bundle, widget_class, *args, **kwargs):
+        """
+        Create (or reuse) a dialog through the dialog manager.
+        """
+        # Note - the base engine implementation will try to clean up
+        # dialogs and widgets after they've been closed.  However this
+        # can cause a crash in Photoshop as the system may try to send
+        # an event after the dialog has been deleted.
+        # The dialog manager keeps dialogs alive and only releases closed
+        # ones through deleteLater, which avoids this.
+        if self._dialog_manager is None:
+            import tk_photoshop
+            self._dialog_manager = tk_photoshop.DialogManager(self)
+        return self._dialog_manager.get_or_create(title, bundle, widget_class, *args, **kwargs)
+
     def show_dialog(self, title, bundle, widget_class, *args, **kwargs):
         """
         Shows a non-modal dialog window in a way suitable for this engine.
@@ -218,14 +244,9 @@ class PhotoshopEngine(tank.platform.Engine):
             return
         
         # create the dialog:
-        dialog, widget = self._create_dialog_with_widget(title, bundle, widget_class, *args, **kwargs)
-        
-        # Note - the base engine implementation will try to clean up
-        # dialogs and widgets after they've been closed.  However this
-        # can cause a crash in Photoshop as the system may try to send 
-        # an event after the dialog has been deleted.
-        # Keeping track of all dialogs will ensure this doesn't happen
-        self.__qt_dialogs.append(dialog)
+        dialog, widget = self._get_dialog_with_widget(title, bundle, widget_class, *args, **kwargs)
+        if self._dialog_warmer is not None:
+            self._dialog_warmer.record_use(title, bundle, widget_class, args, kwargs)
 
         # make sure the window raised so it doesn't
         # appear behind the main Photoshop window
@@ -260,14 +281,7 @@ class PhotoshopEngine(tank.platform.Engine):
         from tank.platform.qt import QtGui
         
         # create the dialog:
-        dialog, widget = self._create_dialog_with_widget(title, bundle, widget_class, *args, **kwargs)
-        
-        # Note - the base engine implementation will try to clean up
-        # dialogs and widgets after they've been closed.  However this
-        # can cause a crash in Photoshop as the system may try to send 
-        # an event after the dialog has been deleted.      
-        # Keeping track of all dialogs will ensure this doesn't happen  
-        self.__qt_dialogs.append(dialog)
+        dialog, widget = self._get_dialog_with_widget(title, bundle, widget_class, *args, **kwargs)
         
         # make sure the window raised so it doesn't
         # appear behind the main Photoshop window
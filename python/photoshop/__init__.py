@@ -14,6 +14,14 @@ import logging
 
 # local modules
 import flexbase
+import executor
+import coroutine
+import pixels
+import snapshot
+import events
+import transaction as _transaction
+import action_manager
+import panel
 
 # setup logging
 ################################################################################
@@ -42,17 +50,46 @@ sys.execpthook = logging_excepthook
 # setup actionscript integration
 ################################################################################
 def clear_panel():
+    panel.invalidate()
     flexbase.requestClearPanel()
 
 
 def set_message(message):
+    panel.invalidate()
     flexbase.requestSetMessage(message)
 
 
+def set_panel(layout):
+    """
+    Show a PanelLayout in the panel, sending only what changed since the
+    last call.
+    """
+    panel.set_panel(layout)
+
+
 def add_button(label, callback):
     flexbase.requestAddButton(label, callback)
 
 
+def subscribe(event, callback, filter=None, debounce_ms=0):
+    """
+    Call callback(events) on the main thread with batches of event payloads.
+    Filtering (a dict of payload values) and debouncing happen in the panel.
+    """
+    return events.subscribe(event, callback, filter=filter, debounce_ms=debounce_ms)
+
+
+def transaction(name, suppress_redraw=True, rollback_on_error=False):
+    """
+    Context manager collecting the edits queued with set(), call() and
+    action() and sending them in one request when the block exits, which
+    the panel applies as one history state with redraws suppressed.  Needs
+    a panel with transaction support, otherwise the edits are sent one by
+    one and a warning is logged, see photoshop.transaction.
+    """
+    return _transaction.Transaction(name, suppress_redraw, rollback_on_error)
+
+
 def RemoteObject(cls, *args, **kwargs):
     return flexbase.RemoteObject(cls, *args, **kwargs)
 
@@ -61,13 +98,104 @@ def StaticObject(cls, prop):
     return flexbase.requestStatic(cls, prop)
 
 
+def typed_array(values, dtype='f8'):
+    """
+    Pack numbers (e.g. selection polygon points) into an array that is sent
+    to Photoshop as one packed value.  dtype is one of i1, u1, i2, u2, i4,
+    u4, f4 or f8.
+    """
+    return flexbase.typedArray(values, dtype)
+
+
+def blob(data):
+    """
+    Wrap bulk binary data so only a handle to a shared mapping is sent to
+    Photoshop.
+    """
+    return flexbase.shared_memory.Blob.create(data)
+
+
+def get_pixels(obj):
+    """
+    Fetch a layer's or document's pixels in one transfer for local checks
+    (is_empty, alpha_coverage, histograms, tight_bounds).
+    """
+    return pixels.get_pixels(obj)
+
+
+def get_snapshot(doc):
+    """
+    Fetch a document's whole layer tree (names, kinds, visibility, opacity,
+    blend modes and bounds) in one round trip as an immutable local tree.
+    """
+    return snapshot.get_snapshot(doc)
+
+
+def get_document_model(doc):
+    """
+    Returns a cached model of doc whose snapshot() is patched from change
+    notifications instead of being re-read.
+    """
+    return snapshot.get_document_model(doc)
+
+
+def call_streaming(obj, method, *args):
+    """
+    Call a remote method without blocking.  The returned future reports
+    progress and yields partial results through chunks() while it runs.
+    """
+    return flexbase.requestCallMethodAsync(obj, method, stream=True, *args)
+
+
+def pipeline(obj):
+    """
+    Start a chain of remote calls on obj that is sent in one round trip by
+    resolve().
+    """
+    return flexbase.PipelinedRef(obj)
+
+
+def resolve(*refs):
+    """
+    Evaluate pipelined references.  Returns the value for a single reference
+    or a list of values.
+    """
+    values = flexbase.requestPipeline(refs)
+    if len(refs) == 1:
+        return values[0]
+    return values
+
+
+def prefetch_stats():
+    """
+    Returns the attribute prefetch hit and waste counts, or None when
+    prefetching is not enabled.
+    """
+    if flexbase.prefetcher is None:
+        return None
+    return flexbase.prefetcher.stats()
+
+
+PHOTOSHOP_CLASS = 'com.adobe.csawlib.photoshop.Photoshop'
+
+
+def capabilities():
+    """
+    Returns what the installed panel supports, see flexbase.Capabilities.
+    """
+    return flexbase.FlexRequest.capabilities
+
+
 # plugin initialization will call the app setup
-def initialize_photoshop_application(remote_port, heartbeat_port):
+def initialize_photoshop_application(remote_port, heartbeat_port, handshake=False):
     global app
     try:
         logger.error("FB: %s" % str(flexbase))
-        flexbase.setup(remote_port, heartbeat_port)
-        app = flexbase.requestStatic('com.adobe.csawlib.photoshop.Photoshop', 'app')
+        # with a panel that does the handshake, app, its version and its
+        # class description come back with it
+        flexbase.setup(remote_port, heartbeat_port,
+            statics=[(PHOTOSHOP_CLASS, 'app', ['version'])], handshake=handshake)
+        app = flexbase.requestStatic(PHOTOSHOP_CLASS, 'app')
         logger.info("Photoshop version is '%s'", app.version)
     except:
         log_exception('error in initializePhotoshopApplication')
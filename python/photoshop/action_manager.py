@@ -0,0 +1,335 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+ActionManager bridge.
+
+Descriptors, references and lists are built locally and the whole tree is
+sent in a single request that runs executeAction/executeActionGet on the
+host, which is much faster than the DOM for layer queries and bulk edits:
+
+    ref = ActionReference()
+    ref.putProperty(charID('Prpr'), stringID('layerID'))
+    ref.putEnumerated(charID('Lyr '), charID('Ordn'), charID('Trgt'))
+    result = execute_action_get(ref)
+    layer_id = result['layerID']
+
+IDs are either charIDs, converted locally since they are just the four
+characters packed into an integer, or stringIDs.  Unknown stringIDs are sent
+by name and converted by the host in the same request; the host reports the
+typeIDs it used so later requests and results need no conversion at all.
+Results come back as plain python dicts and lists keyed by stringID (or the
+charID when the host has no stringID for a key).
+"""
+import json
+import struct
+import logging
+import threading
+
+from . import flexbase
+
+logger = logging.getLogger('sgtk.photoshop.action_manager')
+
+DIALOG_MODES = ('no', 'error', 'all')
+
+
+# typeID cache
+################################################################################
+_ids_lock = threading.Lock()
+_string_to_type = {}
+_type_to_string = {}
+
+
+def charID(code):
+    """
+    Returns the typeID for a four character code, without a round trip.
+    """
+    if len(code) != 4:
+        raise ValueError("charIDs are four characters, got '%s'" % code)
+    return struct.unpack('>I', str(code))[0]
+
+
+def typeIDToCharID(type_id):
+    return struct.pack('>I', type_id)
+
+
+class StringID(object):
+    """
+    A stringID whose typeID is not known locally yet.
+    """
+    __slots__ = ('name', )
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "stringID('%s')" % self.name
+
+
+def stringID(name):
+    """
+    Returns the cached typeID for name, or a StringID for the host to convert.
+    """
+    with _ids_lock:
+        type_id = _string_to_type.get(name)
+    if type_id is not None:
+        return type_id
+    return StringID(name)
+
+
+def typeIDToStringID(type_id):
+    """
+    Returns the cached stringID for a typeID, or None.
+    """
+    with _ids_lock:
+        return _type_to_string.get(type_id)
+
+
+def _update_ids(ids):
+    with _ids_lock:
+        for (name, type_id) in ids.iteritems():
+            _string_to_type[name] = type_id
+            _type_to_string[type_id] = name
+
+
+def _encode_id(value):
+    if isinstance(value, StringID):
+        value = stringID(value.name)
+    if isinstance(value, StringID):
+        return {'s': value.name}
+    if isinstance(value, basestring):
+        return _encode_id(stringID(value))
+    return int(value)
+
+
+# builders
+################################################################################
+class _Container(object):
+    def __init__(self):
+        self._items = []
+
+    def _put(self, key, kind, value, **extra):
+        item = {'type': kind, 'value': value}
+        if key is not None:
+            item['key'] = _encode_id(key)
+        item.update(extra)
+        self._items.append(item)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _ValueContainer(_Container):
+    """
+    put methods shared by descriptors (keyed) and lists (unkeyed).
+    """
+    def _putString(self, key, value):
+        self._put(key, 'string', value)
+
+    def _putInteger(self, key, value):
+        self._put(key, 'integer', int(value))
+
+    def _putDouble(self, key, value):
+        self._put(key, 'double', float(value))
+
+    def _putBoolean(self, key, value):
+        self._put(key, 'boolean', bool(value))
+
+    def _putUnitDouble(self, key, unit, value):
+        self._put(key, 'unitDouble', float(value), unit=_encode_id(unit))
+
+    def _putEnumerated(self, key, enum_type, value):
+        self._put(key, 'enumerated', _encode_id(value), enumType=_encode_id(enum_type))
+
+    def _putClass(self, key, value):
+        self._put(key, 'class', _encode_id(value))
+
+    def _putReference(self, key, value):
+        self._put(key, 'reference', value.to_dict())
+
+    def _putObject(self, key, class_id, value):
+        self._put(key, 'object', value.to_dict(), classID=_encode_id(class_id))
+
+    def _putList(self, key, value):
+        self._put(key, 'list', value.to_dict())
+
+    def _putPath(self, key, value):
+        self._put(key, 'path', value)
+
+
+class ActionDescriptor(_ValueContainer):
+    def putString(self, key, value):
+        self._putString(key, value)
+
+    def putInteger(self, key, value):
+        self._putInteger(key, value)
+
+    def putDouble(self, key, value):
+        self._putDouble(key, value)
+
+    def putBoolean(self, key, value):
+        self._putBoolean(key, value)
+
+    def putUnitDouble(self, key, unit, value):
+        self._putUnitDouble(key, unit, value)
+
+    def putEnumerated(self, key, enum_type, value):
+        self._putEnumerated(key, enum_type, value)
+
+    def putClass(self, key, value):
+        self._putClass(key, value)
+
+    def putReference(self, key, value):
+        self._putReference(key, value)
+
+    def putObject(self, key, class_id, value):
+        self._putObject(key, class_id, value)
+
+    def putList(self, key, value):
+        self._putList(key, value)
+
+    def putPath(self, key, value):
+        self._putPath(key, value)
+
+    def to_dict(self):
+        return {'descriptor': self._items}
+
+
+class ActionList(_ValueContainer):
+    def putString(self, value):
+        self._putString(None, value)
+
+    def putInteger(self, value):
+        self._putInteger(None, value)
+
+    def putDouble(self, value):
+        self._putDouble(None, value)
+
+    def putBoolean(self, value):
+        self._putBoolean(None, value)
+
+    def putUnitDouble(self, unit, value):
+        self._putUnitDouble(None, unit, value)
+
+    def putEnumerated(self, enum_type, value):
+        self._putEnumerated(None, enum_type, value)
+
+    def putClass(self, value):
+        self._putClass(None, value)
+
+    def putReference(self, value):
+        self._putReference(None, value)
+
+    def putObject(self, class_id, value):
+        self._putObject(None, class_id, value)
+
+    def putList(self, value):
+        self._putList(None, value)
+
+    def putPath(self, value):
+        self._putPath(None, value)
+
+    def to_dict(self):
+        return {'list': self._items}
+
+
+class ActionReference(_Container):
+    def _put_form(self, form, desired_class, value=None, **extra):
+        item = {'form': form, 'desiredClass': _encode_id(desired_class)}
+        if value is not None:
+            item['value'] = value
+        item.update(extra)
+        self._items.append(item)
+
+    def putClass(self, desired_class):
+        self._put_form('class', desired_class)
+
+    def putName(self, desired_class, name):
+        self._put_form('name', desired_class, name)
+
+    def putIndex(self, desired_class, index):
+        self._put_form('index', desired_class, int(index))
+
+    def putIdentifier(self, desired_class, identifier):
+        self._put_form('identifier', desired_class, int(identifier))
+
+    def putOffset(self, desired_class, offset):
+        self._put_form('offset', desired_class, int(offset))
+
+    def putProperty(self, desired_class, prop):
+        self._put_form('property', desired_class, _encode_id(prop))
+
+    def putEnumerated(self, desired_class, enum_type, value):
+        self._put_form('enumerated', desired_class, _encode_id(value),
+            enumType=_encode_id(enum_type))
+
+    def to_dict(self):
+        return {'reference': self._items}
+
+
+# execution
+################################################################################
+def _request(request):
+    flexbase.FlexRequest.require(request['type'])
+    results = flexbase.FlexRequest(json.dumps(request))()
+    results = json.loads(results)
+    if results.get('type') == 'error':
+        flexbase.dictToPython(results)
+    _update_ids(results.get('ids', {}))
+    return results
+
+
+def execute_action(event, descriptor=None, dialog_mode='no'):
+    """
+    Run executeAction on the host, returns the result descriptor as a dict.
+    """
+    if dialog_mode not in DIALOG_MODES:
+        raise ValueError("dialog_mode must be one of %s" % (DIALOG_MODES, ))
+    logger.debug("execute_action(%s)", event)
+    request = {
+        'type': 'executeaction',
+        'event': _encode_id(event),
+        'descriptor': descriptor.to_dict() if descriptor is not None else None,
+        'dialog_mode': dialog_mode,
+    }
+    flexbase._noteMutation()
+    return _request(request).get('result')
+
+
+def execute_actions(actions, dialog_mode='no'):
+    """
+    Run a list of (event, descriptor) pairs in order in a single request,
+    returns the list of result descriptors.
+    """
+    if dialog_mode not in DIALOG_MODES:
+        raise ValueError("dialog_mode must be one of %s" % (DIALOG_MODES, ))
+    logger.debug("execute_actions(%d actions)", len(actions))
+    request = {
+        'type': 'executeactions',
+        'actions': [{
+            'event': _encode_id(event),
+            'descriptor': descriptor.to_dict() if descriptor is not None else None,
+        } for (event, descriptor) in actions],
+        'dialog_mode': dialog_mode,
+    }
+    flexbase._noteMutation()
+    return _request(request).get('results', [])
+
+
+def execute_action_get(reference):
+    """
+    Run executeActionGet on the host, returns the descriptor as a dict.
+    """
+    logger.debug("execute_action_get()")
+    request = {
+        'type': 'executeactionget',
+        'reference': reference.to_dict(),
+    }
+    return _request(request).get('result')
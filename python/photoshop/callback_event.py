@@ -13,10 +13,32 @@ framework for running callbacks in the main PySide GUI thread
 
 This is used by the logging console to update the gui on the main thread
 and so it cannot use logging itself
+
+Callbacks are queued under a lock and a single wakeup event is posted to
+the Qt event queue while callbacks are pending.  Each wakeup drains the
+queue in priority order (first in first out within a priority) until it is
+empty or the drain has run for SGTK_PHOTOSHOP_DISPATCH_BUDGET_MS, then
+posts another wakeup so paint and input events get a turn in between.
+
+A callback may not return for a long time (show_modal runs a nested event
+loop), so a new wakeup is posted before each callback while more are
+queued, and callbacks queued while one runs post their own.
 """
+import os
+import time
+import heapq
 import logging
+import itertools
+import threading
 from PySide import QtCore
 
+DISPATCH_BUDGET = 'SGTK_PHOTOSHOP_DISPATCH_BUDGET_MS'
+
+# priorities, lower runs first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
 
 class RunCallbackEvent(QtCore.QEvent):
     EVENT_TYPE = QtCore.QEvent.Type(QtCore.QEvent.registerEventType())
@@ -28,21 +50,131 @@ class RunCallbackEvent(QtCore.QEvent):
         self.kwargs = kwargs
 
 
+class WakeupEvent(QtCore.QEvent):
+    EVENT_TYPE = QtCore.QEvent.Type(QtCore.QEvent.registerEventType())
+
+    def __init__(self):
+        QtCore.QEvent.__init__(self, WakeupEvent.EVENT_TYPE)
+
+
 class CallbackRunner(QtCore.QObject):
     _logger = logging.getLogger('sgtk.photoshop.engine')
 
+    def __init__(self, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        # a wakeup event is in the Qt queue and not handled yet
+        self._wakeup_pending = False
+        try:
+            self.budget = float(os.getenv(DISPATCH_BUDGET, '20'))/1000.0
+        except ValueError:
+            self.budget = 0.02
+        self.reset_stats()
+
+    def post(self, fn, args=(), kwargs=None, priority=NORMAL):
+        """
+        Queue fn(*args, **kwargs) to run on the main thread.
+        """
+        entry = (priority, next(self._sequence), time.time(), fn, args, kwargs or {})
+        with self._lock:
+            heapq.heappush(self._queue, entry)
+            if self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        QtCore.QCoreApplication.postEvent(self, WakeupEvent())
+
     def event(self, event):
+        if event.type() == WakeupEvent.EVENT_TYPE:
+            self._drain()
+            return True
+        if event.type() == RunCallbackEvent.EVENT_TYPE:
+            # posted directly as a RunCallbackEvent
+            self._run(event.fn, event.args, event.kwargs)
+            return True
+        return QtCore.QObject.event(self, event)
+
+    def _run(self, fn, args, kwargs):
         try:
-            if (getattr(event.fn, '_tkLog', True)):
-                self._logger.info("Callback %s", str(event.fn))
-            event.fn(*event.args, **event.kwargs)
+            if getattr(fn, '_tkLog', True) and self._logger.isEnabledFor(logging.DEBUG):
+                self._logger.debug("Callback %s", fn)
+            fn(*args, **kwargs)
         except Exception:
-            self._logger.exception("Error in callback %s", str(event.fn))
-        return True
+            self._logger.exception("Error in callback %s", str(fn))
+
+    def _drain(self):
+        start = time.time()
+        deadline = start + self.budget
+        ran = 0
+        with self._lock:
+            self._wakeup_pending = False
+        while True:
+            with self._lock:
+                if not self._queue:
+                    break
+                (_, _, queued, fn, args, kwargs) = heapq.heappop(self._queue)
+                # keep a wakeup posted for the rest, fn may block in a
+                # nested event loop
+                repost = bool(self._queue) and not self._wakeup_pending
+                if repost:
+                    self._wakeup_pending = True
+            if repost:
+                QtCore.QCoreApplication.postEvent(self, WakeupEvent())
+            now = time.time()
+            self._note_latency(now - queued)
+            self._run(fn, args, kwargs)
+            ran += 1
+            if time.time() >= deadline:
+                # out of budget, the posted wakeup continues once the
+                # event loop had a chance to paint
+                break
+        self._stats['drains'] += 1
+        self._stats['drain_max'] = max(self._stats['drain_max'], ran)
+
+    def _note_latency(self, latency):
+        stats = self._stats
+        stats['callbacks'] += 1
+        stats['latency_total'] += latency
+        if latency > stats['latency_max']:
+            stats['latency_max'] = latency
+
+    def reset_stats(self):
+        self._stats = {
+            'callbacks': 0,
+            'drains': 0,
+            'drain_max': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def stats(self):
+        """
+        Returns the number of callbacks run and wakeups handled, the most
+        callbacks run by one wakeup, the queue latency (seconds from post to
+        run) average and maximum, and the number of callbacks still queued.
+        """
+        stats = dict(self._stats)
+        stats['latency_avg'] = stats['latency_total']/stats['callbacks'] if stats['callbacks'] else 0.0
+        with self._lock:
+            stats['queued'] = len(self._queue)
+        return stats
 
 g_callbackRunner = CallbackRunner()
 
 
 def send_to_main_thread(fn, *args, **kwargs):
     global g_callbackRunner
-    QtCore.QCoreApplication.postEvent(g_callbackRunner, RunCallbackEvent(fn, *args, **kwargs))
+    g_callbackRunner.post(fn, args, kwargs)
+
+
+def post_to_main_thread(fn, args=(), kwargs=None, priority=NORMAL):
+    """
+    send_to_main_thread with a priority, HIGH callbacks run before NORMAL
+    and LOW ones that are already queued.
+    """
+    g_callbackRunner.post(fn, args, kwargs, priority)
+
+
+def dispatch_stats():
+    return g_callbackRunner.stats()
@@ -0,0 +1,237 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Table driven codec for values crossing the bridge.
+
+Python values are encoded to {'type': <tag>, ...} dicts through a table
+keyed by the exact python type (falling back to the first registered base
+class, which is then cached), and decoded through a table keyed by tag.
+Modules that add value types register their own entries:
+
+    codec.default.register_encoder(Blob, lambda codec, v: v.handle())
+    codec.default.register_decoder('Blob', decode_blob)
+
+The panel understands the long tag names.  Once it advertises support,
+setting compact on the codec switches the encoder to one character tags.
+The decoder always accepts both.
+"""
+import time
+import calendar
+import datetime
+
+# long tag -> compact tag
+COMPACT_TAGS = {
+    'null': 'n',
+    'undefined': 'u',
+    'String': 's',
+    'Number': 'f',
+    'Boolean': 'b',
+    'int': 'i',
+    'uint': 'I',
+    'Array': 'a',
+    'Object': 'o',
+    'Date': 'd',
+    'TypedArray': 't',
+    'Blob': 'B',
+    'RemoteObject': 'r',
+    'error': 'e',
+}
+
+# tags whose value is used as is
+PLAIN_TAGS = frozenset(['String', 'Number', 'Boolean', 'int', 'uint', 's', 'f', 'b', 'i', 'I'])
+
+INT_MIN = -2**31
+INT_MAX = 2**31 - 1
+
+
+class Codec(object):
+    def __init__(self, compact=False, features=None):
+        self._encoders = {}
+        self._decoders = {}
+        self._registered = []
+        self.compact = compact
+        # the value features the other side agreed to, None allows all
+        self.features = features
+
+    def register_encoder(self, py_type, fn):
+        """
+        Encode values of py_type (and its subclasses) with fn(codec, value).
+        """
+        self._registered.append((py_type, fn))
+        self._encoders[py_type] = fn
+
+    def register_decoder(self, tag, fn):
+        """
+        Decode dicts tagged with tag (or its compact form) with fn(codec, d).
+        """
+        self._decoders[tag] = fn
+        if tag in COMPACT_TAGS:
+            self._decoders[COMPACT_TAGS[tag]] = fn
+
+    def require(self, feature, value):
+        """
+        Raise ValueError for a value the other side cannot decode.
+        """
+        if self.features is not None and feature not in self.features:
+            raise ValueError("Cannot send %s values, the panel does not support '%s'" % (
+                type(value).__name__, feature))
+
+    def tag(self, name):
+        if self.compact:
+            return COMPACT_TAGS.get(name, name)
+        return name
+
+    def _find_encoder(self, py_type):
+        # old style classes have no mro, fall back to an isinstance scan
+        for base in getattr(py_type, '__mro__', ()):
+            if base in self._encoders:
+                fn = self._encoders[base]
+                self._encoders[py_type] = fn
+                return fn
+        return None
+
+    def encode(self, value):
+        fn = self._encoders.get(type(value))
+        if fn is None:
+            fn = self._find_encoder(type(value))
+            if fn is None:
+                for (py_type, candidate) in self._registered:
+                    if isinstance(value, py_type):
+                        fn = candidate
+                        break
+                else:
+                    raise ValueError("Unhandled python object (%s) '%s'" % (type(value), value))
+        return fn(self, value)
+
+    def decode(self, d):
+        if d is None:
+            return None
+        fn = self._decoders.get(d['type'])
+        if fn is None:
+            raise ValueError("Unknown reponse object '%s'" % d)
+        return fn(self, d)
+
+
+# encoders
+################################################################################
+def _encode_none(codec, v):
+    return {'type': codec.tag('null')}
+
+
+def _encode_string(codec, v):
+    return {'type': codec.tag('String'), 'value': v}
+
+
+def _encode_bool(codec, v):
+    return {'type': codec.tag('Boolean'), 'value': v}
+
+
+def _encode_int(codec, v):
+    # actionscript ints are 32 bit, anything larger travels as a Number
+    if INT_MIN <= v <= INT_MAX:
+        return {'type': codec.tag('int'), 'value': v}
+    return {'type': codec.tag('Number'), 'value': v}
+
+
+def _encode_float(codec, v):
+    return {'type': codec.tag('Number'), 'value': v}
+
+
+def _encode_sequence(codec, v):
+    # dispatch elements straight from the table, this is the hot loop
+    encoders = codec._encoders
+    encode = codec.encode
+    return {'type': codec.tag('Array'), 'value': [
+        encoders[type(e)](codec, e) if type(e) in encoders else encode(e) for e in v]}
+
+
+def _encode_dict(codec, v):
+    codec.require('objects', v)
+    encode = codec.encode
+    value = {}
+    for (k, e) in v.iteritems():
+        if not isinstance(k, basestring):
+            raise ValueError("Object keys must be strings, got (%s) '%s'" % (type(k), k))
+        value[k] = encode(e)
+    return {'type': codec.tag('Object'), 'value': value}
+
+
+def _encode_datetime(codec, v):
+    # milliseconds since the epoch, naive datetimes are local time
+    codec.require('dates', v)
+    if v.tzinfo is not None:
+        seconds = calendar.timegm(v.utctimetuple())
+    else:
+        seconds = time.mktime(v.timetuple())
+    return {'type': codec.tag('Date'), 'value': seconds*1000 + v.microsecond//1000}
+
+
+def _encode_date(codec, v):
+    codec.require('dates', v)
+    return {'type': codec.tag('Date'), 'value': time.mktime(v.timetuple())*1000}
+
+
+# decoders
+################################################################################
+def _decode_none(codec, d):
+    return None
+
+
+def _decode_value(codec, d):
+    return d['value']
+
+
+def _decode_array(codec, d):
+    # plain values are unwrapped inline, everything else goes to the table
+    plain = PLAIN_TAGS
+    decode = codec.decode
+    return [e['value'] if e['type'] in plain else decode(e) for e in d['value']]
+
+
+def _decode_object(codec, d):
+    decode = codec.decode
+    return dict((k, decode(e)) for (k, e) in d['value'].iteritems())
+
+
+def _decode_date(codec, d):
+    return datetime.datetime.fromtimestamp(d['value']/1000.0)
+
+
+def _decode_error(codec, d):
+    raise RuntimeError(d['stack'])
+
+
+def _register_defaults(codec):
+    codec.register_encoder(type(None), _encode_none)
+    codec.register_encoder(str, _encode_string)
+    codec.register_encoder(unicode, _encode_string)
+    codec.register_encoder(bool, _encode_bool)
+    codec.register_encoder(int, _encode_int)
+    codec.register_encoder(long, _encode_int)
+    codec.register_encoder(float, _encode_float)
+    codec.register_encoder(list, _encode_sequence)
+    codec.register_encoder(tuple, _encode_sequence)
+    codec.register_encoder(dict, _encode_dict)
+    codec.register_encoder(datetime.datetime, _encode_datetime)
+    codec.register_encoder(datetime.date, _encode_date)
+
+    for tag in ('null', 'undefined'):
+        codec.register_decoder(tag, _decode_none)
+    for tag in ('String', 'Number', 'Boolean', 'int', 'uint'):
+        codec.register_decoder(tag, _decode_value)
+    codec.register_decoder('Array', _decode_array)
+    codec.register_decoder('Object', _decode_object)
+    codec.register_decoder('Date', _decode_date)
+    codec.register_decoder('error', _decode_error)
+
+
+default = Codec()
+_register_defaults(default)
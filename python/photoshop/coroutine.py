@@ -0,0 +1,183 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Generator based coroutines driven by the Qt event loop.
+
+A task is a generator that yields futures (or lists of futures) for remote
+calls and is resumed on the main thread once they complete, so many remote
+workflows can interleave without blocking and without extra threads:
+
+    from photoshop.coroutine import coroutine, get_prop, Return
+
+    @coroutine
+    def document_summary(doc):
+        (name, width, height) = yield [get_prop(doc, 'name'),
+                                       get_prop(doc, 'width'),
+                                       get_prop(doc, 'height')]
+        raise Return("%s %sx%s" % (name, width, height))
+
+    task = document_summary(doc)
+    task.add_done_callback(on_summary)
+"""
+import sys
+import logging
+import threading
+
+from PySide import QtCore
+
+from . import flexbase
+from . import executor
+from . import callback_event
+
+logger = logging.getLogger('sgtk.photoshop.coroutine')
+
+
+class Return(Exception):
+    """
+    Raise from a task to finish it with a value, generators cannot return
+    values in this version of python.
+    """
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+
+class Task(executor.Future):
+    """
+    Runs a generator on the main thread, resuming it each time the future it
+    yielded completes.  The task itself is a future for the generator result.
+    """
+    def __init__(self, generator):
+        executor.Future.__init__(self)
+        self._generator = generator
+
+    def cancel(self):
+        cancelled = executor.Future.cancel(self)
+        if cancelled:
+            callback_event.send_to_main_thread(self._generator.close)
+        return cancelled
+
+    def _step(self, value=None, exc_info=None):
+        if self.done():
+            return
+        try:
+            if exc_info is not None:
+                yielded = self._generator.throw(*exc_info)
+            else:
+                yielded = self._generator.send(value)
+        except StopIteration:
+            self.set_result(None)
+        except Return, e:
+            self.set_result(e.value)
+        except Exception:
+            self.set_exception(sys.exc_info())
+        else:
+            self._wait_for(yielded)
+    _step._tkLog = False
+
+    def _wait_for(self, yielded):
+        if isinstance(yielded, (list, tuple)):
+            future = gather(yielded)
+        elif isinstance(yielded, executor.Future):
+            future = yielded
+        else:
+            error = TypeError("tasks must yield futures, got %r" % (yielded, ))
+            self._step(exc_info=(TypeError, error, None))
+            return
+        future.add_done_callback(self._resume, main_thread=True)
+
+    def _resume(self, future):
+        try:
+            value = future.result()
+        except Exception:
+            self._step(exc_info=sys.exc_info())
+        else:
+            self._step(value)
+    _resume._tkLog = False
+
+
+def spawn(fn, *args, **kwargs):
+    """
+    Start fn(*args, **kwargs) as a task.  The first step runs on the main
+    thread the next time the event loop gets control.
+    """
+    task = Task(fn(*args, **kwargs))
+    callback_event.send_to_main_thread(task._step)
+    return task
+
+
+def coroutine(fn):
+    """
+    Decorator turning a generator function into one that spawns a task.
+    """
+    def wrapper(*args, **kwargs):
+        return spawn(fn, *args, **kwargs)
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def gather(futures):
+    """
+    Returns a future for the list of results of all the given futures.
+    Fails with the first error.
+    """
+    futures = list(futures)
+    combined = executor.Future()
+    if not futures:
+        combined.set_result([])
+        return combined
+    state = {'remaining': len(futures)}
+    lock = threading.Lock()
+
+    def on_done(future):
+        try:
+            future.result()
+        except Exception:
+            combined.set_exception(sys.exc_info())
+            return
+        with lock:
+            state['remaining'] -= 1
+            finished = (state['remaining'] == 0)
+        if finished:
+            combined.set_result([f.result() for f in futures])
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+def sleep(seconds):
+    """
+    Returns a future that completes after the given delay, for use from tasks.
+    """
+    future = executor.Future()
+    callback_event.send_to_main_thread(
+        QtCore.QTimer.singleShot, int(seconds*1000), lambda: future.set_result(None))
+    return future
+
+
+# remote calls, each returns a future for the decoded result
+################################################################################
+def static(cls, prop):
+    return flexbase.requestStaticAsync(cls, prop)
+
+
+def get_prop(obj, prop):
+    return flexbase.requestGetPropAsync(obj, prop)
+
+
+def set_prop(obj, prop, value):
+    return flexbase.requestSetPropAsync(obj, prop, value)
+
+
+def call_method(obj, method, *args):
+    return flexbase.requestCallMethodAsync(obj, method, *args)
@@ -0,0 +1,193 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Subscriptions to Photoshop application events.
+
+Filtering and debouncing happen on the panel, so only relevant, rate limited
+events cross the socket.  The panel tags each app_event with the
+subscriptions it matched and may coalesce several occurrences:
+
+    {'subscriptions': ['<id>', ...], 'events': [{'doc': 12, ...}, ...]}
+
+Callbacks run on the main thread and receive a list of event payloads, all
+the events that arrived since the last delivery are handed over in one go.
+
+Panels without the 'subscribe' request send every app_event, and send them
+without a payload.  Debouncing then happens here, and since there is no
+payload to check a filter against, the events are delivered unfiltered (as
+empty dicts); subscribing with a filter logs a warning.
+"""
+import json
+import uuid
+import logging
+import threading
+
+from . import flexbase
+from . import callback_event
+
+logger = logging.getLogger('sgtk.photoshop.events')
+
+
+class Subscription(object):
+    def __init__(self, event, callback, filter=None, debounce_ms=0):
+        self.id = str(uuid.uuid4())
+        self.event = event
+        self.callback = callback
+        self.filter = filter or {}
+        self.debounce_ms = debounce_ms
+        # filtered and debounced here instead of on the panel
+        self.local = False
+
+    def matches(self, payload):
+        # the panel already filtered, this only guards against older panels
+        if not self.filter:
+            return True
+        if not isinstance(payload, dict):
+            return False
+        if self.local and not payload:
+            # older panels send no payload, nothing to filter on
+            return True
+        for (key, value) in self.filter.iteritems():
+            if payload.get(key) != value:
+                return False
+        return True
+
+    def cancel(self):
+        unsubscribe(self)
+
+    def __repr__(self):
+        return "<Subscription %s %s>" % (self.event, self.id)
+
+
+_lock = threading.Lock()
+_subscriptions = {}
+_pending = {}
+# subscription id -> payloads held back until its debounce timer fires
+_held = {}
+_flush_scheduled = False
+_listening = False
+
+
+def _handle_event(event, data):
+    global _flush_scheduled
+    data = data or {}
+    payloads = data.get('events')
+    if payloads is None:
+        payloads = [data]
+    ids = data.get('subscriptions')
+    with _lock:
+        if ids is not None:
+            matched = [_subscriptions[i] for i in ids if i in _subscriptions]
+        else:
+            matched = [s for s in _subscriptions.itervalues() if s.event == event]
+        timers = []
+        for subscription in matched:
+            accepted = [p for p in payloads if subscription.matches(p)]
+            if not accepted:
+                continue
+            if subscription.local and subscription.debounce_ms > 0:
+                if subscription.id not in _held:
+                    timers.append(threading.Timer(subscription.debounce_ms/1000.0,
+                        _release, [subscription.id]))
+                _held.setdefault(subscription.id, []).extend(accepted)
+            else:
+                _pending.setdefault(subscription.id, []).extend(accepted)
+        for timer in timers:
+            timer.daemon = True
+            timer.start()
+        if not _pending or _flush_scheduled:
+            return
+        _flush_scheduled = True
+    callback_event.send_to_main_thread(_flush)
+
+
+def _release(subscription_id):
+    # end of a local debounce window, deliver what arrived during it
+    global _flush_scheduled
+    with _lock:
+        held = _held.pop(subscription_id, None)
+        if held and subscription_id in _subscriptions:
+            _pending.setdefault(subscription_id, []).extend(held)
+        if not _pending or _flush_scheduled:
+            return
+        _flush_scheduled = True
+    callback_event.send_to_main_thread(_flush)
+
+
+def _flush():
+    global _flush_scheduled
+    with _lock:
+        pending = _pending.items()
+        _pending.clear()
+        _flush_scheduled = False
+        subscriptions = dict((i, _subscriptions.get(i)) for (i, _) in pending)
+    for (subscription_id, payloads) in pending:
+        subscription = subscriptions[subscription_id]
+        if subscription is None:
+            # cancelled while the batch was queued
+            continue
+        try:
+            subscription.callback(payloads)
+        except Exception:
+            logger.exception("Error in event callback %s", subscription.callback)
+_flush._tkLog = False
+
+
+def subscribe(event, callback, filter=None, debounce_ms=0):
+    """
+    Call callback(events) on the main thread for event.  filter is a dict
+    of payload keys and the values they must have, debounce_ms coalesces
+    bursts on the panel.  Returns a Subscription.
+    """
+    global _listening
+    subscription = Subscription(event, callback, filter, debounce_ms)
+    with _lock:
+        if not _listening:
+            flexbase.FlexRequest.add_event_listener(_handle_event)
+            _listening = True
+        _subscriptions[subscription.id] = subscription
+    logger.debug("subscribe(%s, %s, %s, %s)", event, callback, filter, debounce_ms)
+    if not flexbase.FlexRequest.supports('subscribe'):
+        # older panels send every app_event, see the module docs
+        subscription.local = True
+        if subscription.filter:
+            logger.warning("The installed Photoshop panel sends no event data, the filter %s "
+                "on '%s' cannot be applied and every such event is delivered",
+                subscription.filter, event)
+        return subscription
+    request = {
+        'type': 'subscribe',
+        'id': subscription.id,
+        'event': event,
+        'filter': subscription.filter,
+        'debounce_ms': debounce_ms,
+    }
+    try:
+        flexbase.FlexRequest(json.dumps(request))()
+    except Exception:
+        with _lock:
+            _subscriptions.pop(subscription.id, None)
+        raise
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        if _subscriptions.pop(subscription.id, None) is None:
+            return
+    logger.debug("unsubscribe(%s)", subscription)
+    if not flexbase.FlexRequest.supports('unsubscribe'):
+        return
+    request = {
+        'type': 'unsubscribe',
+        'id': subscription.id,
+    }
+    flexbase.FlexRequest(json.dumps(request))()
@@ -0,0 +1,247 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Thread pool for driving Photoshop from background threads.
+
+FlexRequest is safe to call from any thread, so long running work that talks
+to Photoshop can be handed to the pool and the GUI thread stays responsive:
+
+    future = photoshop.executor.submit(export_layers, doc)
+    future.add_done_callback(on_exported, main_thread=True)
+"""
+import os
+import sys
+import Queue
+import logging
+import threading
+
+from . import callback_event
+
+MAX_WORKERS = 'SGTK_PHOTOSHOP_MAX_WORKERS'
+
+logger = logging.getLogger('sgtk.photoshop.executor')
+
+
+class CancelledError(Exception):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class Future(object):
+    """
+    The eventual result of an asynchronous operation.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._cancelled = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        with self._cond:
+            return self._done
+
+    def cancelled(self):
+        with self._cond:
+            return self._cancelled
+
+    def cancel(self):
+        """
+        Cancel the operation if it has not completed yet.  Returns True if
+        the future is now cancelled.
+        """
+        with self._cond:
+            if self._done:
+                return self._cancelled
+            self._cancelled = True
+            self._done = True
+            self._cond.notify_all()
+        self._run_callbacks()
+        return True
+
+    def set_result(self, result):
+        with self._cond:
+            if self._done:
+                return
+            self._result = result
+            self._done = True
+            self._cond.notify_all()
+        self._run_callbacks()
+
+    def set_exception(self, exc_info):
+        """
+        Complete the future with an error. exc_info is either an exception
+        instance or a sys.exc_info() tuple, which keeps the original traceback.
+        """
+        if not isinstance(exc_info, tuple):
+            exc_info = (type(exc_info), exc_info, None)
+        with self._cond:
+            if self._done:
+                return
+            self._exc_info = exc_info
+            self._done = True
+            self._cond.notify_all()
+        self._run_callbacks()
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise TimeoutError('timed out waiting for future')
+            if self._cancelled:
+                raise CancelledError()
+
+    def result(self, timeout=None):
+        """
+        Block until the result is available and return it, re-raising any
+        exception the operation failed with.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn, main_thread=False):
+        """
+        Call fn(future) once the future completes.  When main_thread is True
+        the callback is posted to the GUI thread, otherwise it runs on the
+        thread that completed the future.
+        """
+        if main_thread:
+            callback = lambda future: callback_event.send_to_main_thread(fn, future)
+        else:
+            callback = fn
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        self._invoke(callback)
+
+    def _run_callbacks(self):
+        with self._cond:
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            self._invoke(callback)
+
+    def _invoke(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            logger.exception("Error in future callback %s", callback)
+
+
+class ThreadPoolExecutor(object):
+    """
+    A fixed size pool of daemon worker threads.
+    """
+    def __init__(self, max_workers=4, name='PhotoshopWorker'):
+        self._max_workers = max_workers
+        self._name = name
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit work after shutdown')
+            future = Future()
+            self._queue.put((future, fn, args, kwargs))
+            if len(self._threads) < self._max_workers:
+                thread = threading.Thread(target=self._worker,
+                    name="%s-%d" % (self._name, len(self._threads)))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    def map(self, fn, *iterables):
+        """
+        Like the builtin map but runs in the pool, returns the results in order.
+        """
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            (future, fn, args, kwargs) = item
+            if future.cancelled():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+
+# default pool
+################################################################################
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def _get_default_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            try:
+                max_workers = int(os.getenv(MAX_WORKERS, '4'))
+            except ValueError:
+                logger.error("Error setting max workers from %s: %s",
+                    MAX_WORKERS, os.getenv(MAX_WORKERS))
+                max_workers = 4
+            _default_pool = ThreadPoolExecutor(max_workers)
+        return _default_pool
+
+
+def submit(fn, *args, **kwargs):
+    return _get_default_pool().submit(fn, *args, **kwargs)
+
+
+def map(fn, *iterables):
+    return _get_default_pool().map(fn, *iterables)
+
+
+def shutdown(wait=True):
+    global _default_pool
+    with _default_pool_lock:
+        pool = _default_pool
+        _default_pool = None
+    if pool is not None:
+        pool.shutdown(wait)
@@ -9,12 +9,16 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+import sys
 import json
-import math
+import array
+import atexit
+import base64
 import time
 import uuid
 import errno
 import struct
+import itertools
 import socket
 import logging
 import threading
@@ -22,7 +26,15 @@ import xml.etree.cElementTree as etree
 
 from PySide import QtCore, QtGui
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import codec
+from . import executor
 from . import callback_event
+from . import shared_memory
 
 PYTHON_REQUEST = 1
 PYTHON_RESPONSE = 2
@@ -35,11 +47,68 @@ PONG = 6  # ACK
 PYTHON_CALLBACK = 10004
 SET_PORT = 10005
 
+PROTOCOL_VERSION = 2
+
 HEARTBEAT_TIMEOUT = 'SGTK_PHOTOSHOP_HEARTBEAT_TIMEOUT'
 HEARTBEAT_INTERVAL = 'SGTK_PHOTOSHOP_HEARTBEAT_INTERVAL'
 HEARTBEAT_TOLERANCE = 'SGTK_PHOTOSHOP_HEARTBEAT_TOLERANCE'
 PHOTOSHOP_TIMEOUT = 'SGTK_PHOTOSHOP_TIMEOUT'
+HANDSHAKE_TIMEOUT = 'SGTK_PHOTOSHOP_HANDSHAKE_TIMEOUT'
+PREFETCH = 'SGTK_PHOTOSHOP_PREFETCH'
+PREFETCH_PROFILE = 'SGTK_PHOTOSHOP_PREFETCH_PROFILE'
 NETWORK_DEBUG = os.getenv('SGTK_PHOTOSHOP_NETWORK_DEBUG')
+LOG_PAYLOAD_BYTES = 'SGTK_PHOTOSHOP_LOG_PAYLOAD_BYTES'
+LOG_PAYLOAD_BUDGET = 'SGTK_PHOTOSHOP_LOG_PAYLOAD_BUDGET'
+
+logger = logging.getLogger('sgtk.photoshop.flexbase')
+
+
+class PayloadLog(object):
+    """
+    Shortens request and response payloads for the log.  Each payload is
+    cut to max_bytes and at most budget bytes of payload per second are
+    logged (a token bucket), the rest are replaced by their size so debug
+    logging can stay on under heavy traffic.  Only call describe once the
+    log level check passed.
+    """
+    def __init__(self, max_bytes=None, budget=None):
+        self.max_bytes = max_bytes if max_bytes is not None else self._env_int(LOG_PAYLOAD_BYTES, 2048)
+        self.budget = budget if budget is not None else self._env_int(LOG_PAYLOAD_BUDGET, 65536)
+        self._lock = threading.Lock()
+        self._tokens = float(self.budget)
+        self._last = time.time()
+        self._suppressed = 0
+
+    @staticmethod
+    def _env_int(name, default):
+        try:
+            return int(os.getenv(name, default))
+        except ValueError:
+            logger.error(
+                "Error setting %s from %s", name, os.getenv(name))
+            return default
+
+    def describe(self, payload):
+        size = len(payload)
+        shown = payload if size <= self.max_bytes else payload[:self.max_bytes]
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.budget, self._tokens + (now - self._last)*self.budget)
+            self._last = now
+            if self._tokens < len(shown):
+                self._suppressed += 1
+                return "<%d bytes, over the payload log budget>" % size
+            self._tokens -= len(shown)
+            suppressed = self._suppressed
+            self._suppressed = 0
+        if len(shown) < size:
+            shown = "%s... <%d of %d bytes>" % (shown, len(shown), size)
+        if suppressed:
+            shown = "%s (%d payloads not logged)" % (shown, suppressed)
+        return shown
+
+
+payload_log = PayloadLog()
 
 
 def handle_show_log():
@@ -50,11 +119,51 @@ def handle_show_log():
     win.raise_()
 
 
+class Capabilities(object):
+    """
+    What the installed panel supports, as agreed in the startup handshake.
+    Panels that predate the handshake get the legacy defaults.
+    """
+    LEGACY_REQUESTS = frozenset(['setmessage', 'clearpanel', 'addbutton', 'static',
+        'classdef', 'objcreate', 'setprop', 'getprop', 'callmethod'])
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.protocol = data.get('protocol', 1)
+        self.requests = frozenset(data.get('requests', self.LEGACY_REQUESTS))
+        self.features = frozenset(data.get('features', ()))
+        self.framing = tuple(data.get('framing', ('xml', )))
+        self.max_payload = data.get('max_payload')
+
+    def supports(self, request_type):
+        return request_type in self.requests
+
+    def has_feature(self, feature):
+        return feature in self.features
+
+    def __repr__(self):
+        return "<Capabilities protocol=%s requests=%s features=%s framing=%s max_payload=%s>" % (
+            self.protocol, sorted(self.requests), sorted(self.features),
+            self.framing, self.max_payload)
+
+
 class FlexRequest(object):
+    # the python side of the handshake
+    RESPONSE_TYPES = ('requestResponse', 'requestProgress', 'callback', 'menu_click', 'app_event')
+    FEATURES = ('compact_tags', 'typed_arrays', 'blobs', 'objects', 'dates', 'streaming', 'prefetch')
+
+    capabilities = Capabilities()
+    startup = {}
+
     @classmethod
-    def setup(cls, remote_port, heartbeat_port):
+    def setup(cls, remote_port, heartbeat_port, statics=(), handshake=False):
+        # pending requests and panel callbacks are shared between the
+        # calling threads and the connection handler threads
         cls.requests = {}
+        cls.requests_lock = threading.Lock()
         cls.callbacks = {}
+        cls.callbacks_lock = threading.Lock()
+        cls.event_listeners = []
         cls.remote_port = remote_port
         cls.heartbeat_port = heartbeat_port
         cls.local_port = None
@@ -84,6 +193,76 @@ class FlexRequest(object):
         heartbeat = threading.Thread(target=cls.HeartbeatThreadRun, name="HeartbeatThread")
         heartbeat.start()
 
+        if handshake:
+            cls.Handshake(statics)
+
+    @classmethod
+    def Handshake(cls, statics):
+        """
+        Exchange protocol version and capabilities with the panel.  The
+        startup lookups ride along: statics is a list of (cls, prop, props)
+        whose values come back with the listed properties already filled in,
+        together with the class description of each value's class.
+
+        Panels from before the handshake never answer, setup only sends it
+        when the installed extension is new enough.  The timeout is kept
+        short in case it is not.
+        """
+        request = {
+            'type': 'hello',
+            'protocol': PROTOCOL_VERSION,
+            'responses': cls.RESPONSE_TYPES,
+            'features': cls.FEATURES,
+            'statics': [{'cls': c, 'prop': p, 'props': list(props), 'classdef': True}
+                for (c, p, props) in statics],
+        }
+        try:
+            timeout = float(os.getenv(HANDSHAKE_TIMEOUT, '1.0'))
+        except:
+            cls.logger.error("Error setting timeout from %s: %s",
+                HANDSHAKE_TIMEOUT, os.getenv(HANDSHAKE_TIMEOUT))
+            timeout = 1.0
+        try:
+            results = json.loads(cls(json.dumps(request), timeout=timeout, quiet=True)())
+        except Exception:
+            results = None
+        if not isinstance(results, dict) or 'protocol' not in results:
+            cls.logger.debug("Panel does not support the handshake, using the legacy protocol")
+            cls.capabilities = Capabilities()
+            return
+
+        cls.capabilities = Capabilities(results)
+        cls.logger.info("Panel capabilities: %s", cls.capabilities)
+        codec.default.compact = cls.capabilities.has_feature('compact_tags')
+        codec.default.features = cls.capabilities.features
+
+        for static in results.get('statics', ()):
+            # the value's class description first, decoding the value needs it
+            name = isinstance(static['value'], dict) and static['value'].get('cls')
+            xml = static.get('classdef')
+            if name and xml:
+                try:
+                    RemoteObject.preload_class_desc(name, etree.XML(xml))
+                except Exception:
+                    cls.logger.exception("Invalid class description for %s", name)
+            value = dictToPython(static['value'])
+            _prefetchResponse(None, static['value'], value)
+            cls.startup[(static['cls'], static['prop'])] = value
+
+    @classmethod
+    def supports(cls, request_type):
+        return cls.capabilities.supports(request_type)
+
+    @classmethod
+    def require(cls, request_type):
+        """
+        Fail fast for requests the installed panel cannot answer, instead of
+        waiting for them to time out.
+        """
+        if not cls.capabilities.supports(request_type):
+            raise RuntimeError("The installed Photoshop panel does not support '%s' requests, "
+                "please update the extension" % request_type)
+
     @classmethod
     def ActivatePython(cls):
         """
@@ -127,6 +306,7 @@ class FlexRequest(object):
 
             while True:
                 time.sleep(interval)
+                cls.ExpireSubmittedRequests()
                 try:
                     sent = s.send(struct.pack("i", PING))
                     if sent == 0:
@@ -149,8 +329,25 @@ class FlexRequest(object):
                     cls.logger.exception("Python: Heartbeat unknown exception")
                 if error_cycle >= tolerance:
                     cls.logger.error("Python: Quitting.  Heartbeat errors greater than tolerance.")
+                    _runExitHooks()
                     os._exit(0)
 
+    @classmethod
+    def ExpireSubmittedRequests(cls):
+        """
+        Fail submitted requests that have not been answered in time.  Blocking
+        calls time out on their own.
+        """
+        now = time.time()
+        expired = []
+        with cls.requests_lock:
+            for (uid, pending) in cls.requests.items():
+                if pending['future'] is not None and pending['deadline'] < now:
+                    expired.append(cls.requests.pop(uid))
+        for pending in expired:
+            pending['future'].set_exception(
+                RuntimeError('timeout waiting for response: %s' % pending['request']))
+
     @classmethod
     def ListenThreadRun(cls):
         while True:
@@ -172,23 +369,55 @@ class FlexRequest(object):
                 if not buf:
                     break
                 xml += buf
-            if NETWORK_DEBUG is not None:
-                cls.logger.info("[Network Debug] Received Python Response\n\n%s\n\n", xml)
+            if NETWORK_DEBUG is not None and cls.logger.isEnabledFor(logging.INFO):
+                cls.logger.info("[Network Debug] Received Python Response\n\n%s\n\n",
+                    payload_log.describe(xml))
             dom = etree.XML(xml)
             type = dom.find('type').text
             if type == 'requestResponse':
                 uid = dom.find('uid').text
                 response = dom.find('data').text
                 # and send it back to the request
-                FlexRequest.requests[uid]['cond'].acquire()
-                FlexRequest.requests[uid]['response'] = response
-                FlexRequest.requests[uid]['responded'] = True
-                FlexRequest.requests[uid]['cond'].notify_all()
-                FlexRequest.requests[uid]['cond'].release()
+                with cls.requests_lock:
+                    pending = cls.requests.get(uid)
+                if pending is None:
+                    cls.logger.error('response for unknown request: %s', uid)
+                    return
+                with pending['cond']:
+                    pending['response'] = response
+                    pending['responded'] = True
+                    pending['cond'].notify_all()
+                if pending['future'] is not None:
+                    # nobody waits on submitted requests, clean up here
+                    with cls.requests_lock:
+                        cls.requests.pop(uid, None)
+                    pending['future']._complete(response)
+            elif type == 'requestProgress':
+                uid = dom.find('uid').text
+                with cls.requests_lock:
+                    pending = cls.requests.get(uid)
+                if pending is None:
+                    cls.logger.debug('progress for unknown request: %s', uid)
+                    return
+                # any sign of life keeps a long running request from timing out
+                pending['deadline'] = time.time() + cls.get_timeout()
+                if pending['future'] is not None:
+                    progress = dom.find('progress')
+                    message = dom.find('message')
+                    chunk = dom.find('chunk')
+                    pending['future']._update(
+                        float(progress.text) if progress is not None else None,
+                        message.text if message is not None else None,
+                        chunk.text if chunk is not None else None)
             elif type == 'callback':
                 uid = dom.find('uid').text
                 cls.logger.debug('callback: %s', uid)
-                callback_event.send_to_main_thread(cls.callbacks[uid])
+                with cls.callbacks_lock:
+                    callback = cls.callbacks.get(uid)
+                if callback is None:
+                    cls.logger.error('unknown callback: %s', uid)
+                    return
+                callback_event.send_to_main_thread(callback)
             elif type == 'menu_click':
                 menu_id = dom.find('id').text
                 if menu_id == 'show_log':
@@ -196,156 +425,588 @@ class FlexRequest(object):
             elif type == 'app_event':
                 event = dom.find('event').text
                 cls.logger.debug("event: %s", event)
+                data = dom.find('data')
+                if data is not None and data.text:
+                    data = json.loads(data.text)
+                else:
+                    data = None
+                with cls.callbacks_lock:
+                    listeners = list(cls.event_listeners)
+                for listener in listeners:
+                    try:
+                        listener(event, data)
+                    except Exception:
+                        cls.logger.exception("Error in event listener %s", listener)
             else:
                 cls.logger.error('unknown python request type %s', type)
         else:
             cls.logger.error('unknown event type %d', type)
 
-    def __init__(self, request):
+    @classmethod
+    def set_callback(cls, uid, callback):
+        with cls.callbacks_lock:
+            cls.callbacks[uid] = callback
+
+    @classmethod
+    def clear_callbacks(cls):
+        with cls.callbacks_lock:
+            cls.callbacks.clear()
+
+    @classmethod
+    def replace_callbacks(cls, callbacks):
+        with cls.callbacks_lock:
+            cls.callbacks = dict(callbacks)
+
+    @classmethod
+    def add_event_listener(cls, listener):
+        """
+        Call listener(event, data) on the connection handler thread for every
+        app_event from the panel.  data is the decoded JSON payload, or None.
+        """
+        with cls.callbacks_lock:
+            cls.event_listeners.append(listener)
+
+    @classmethod
+    def remove_event_listener(cls, listener):
+        with cls.callbacks_lock:
+            if listener in cls.event_listeners:
+                cls.event_listeners.remove(listener)
+
+    @classmethod
+    def get_timeout(cls):
+        try:
+            return float(os.getenv(PHOTOSHOP_TIMEOUT, '300.0'))
+        except:
+            cls.logger.error("Error setting timeout from %s: %s",
+                PHOTOSHOP_TIMEOUT, os.getenv(PHOTOSHOP_TIMEOUT))
+            return 300.0
+
+    def __init__(self, request, timeout=None, quiet=False):
         self.request = request
         self.response = None
+        self.timeout = timeout
+        # the caller handles failures, e.g. probes that may time out
+        self.quiet = quiet
 
-    def __call__(self):
+    def _register(self, future=None):
         # register this call for the response
         uid = str(uuid.uuid4())
-        self.requests[uid] = {
+        pending = {
             'cond': threading.Condition(),
             'response': None,
             'responded': False,
+            'future': future,
+            'request': self.request,
+            'deadline': time.time() + (self.timeout or self.get_timeout()),
         }
+        with self.requests_lock:
+            self.requests[uid] = pending
+        return (uid, pending)
 
-        try:
-            # build up request xml
-            request = etree.Element("request")
+    def _unregister(self, uid):
+        with self.requests_lock:
+            self.requests.pop(uid, None)
 
-            element = etree.Element("uid")
-            element.text = str(uid)
-            request.append(element)
+    def _send(self, uid):
+        # build up request xml
+        request = etree.Element("request")
 
-            element = etree.Element("data")
-            element.text = str(self.request)
-            request.append(element)
+        element = etree.Element("uid")
+        element.text = str(uid)
+        request.append(element)
 
-            # send request
-            FlexRequest.requests[uid]['cond'].acquire()
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect(('127.0.0.1', self.remote_port))
-
-            req_str = etree.tostring(request)
-            sent = s.send(struct.pack("ii", PYTHON_REQUEST, len(req_str)))
-            totalsent = 0
-            while totalsent < len(req_str):
-                sent = s.send(req_str[totalsent:])
-                if sent == 0:
-                    self.logger.info("SENT 0, error in sending")
-                    return
-                totalsent += sent
+        element = etree.Element("data")
+        element.text = str(self.request)
+        request.append(element)
 
-            response = struct.unpack("i", s.recv(struct.calcsize("i")))[0]
-            if (response != 0):
-                self.logger.error("SENT response non-zero: %d", response)
+        # send request
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect(('127.0.0.1', self.remote_port))
 
+        req_str = etree.tostring(request)
+        max_payload = self.capabilities.max_payload
+        if max_payload is not None and len(req_str) > max_payload:
             s.close()
+            raise ValueError("request of %d bytes exceeds the panel limit of %d bytes"
+                % (len(req_str), max_payload))
+        sent = s.send(struct.pack("ii", PYTHON_REQUEST, len(req_str)))
+        totalsent = 0
+        while totalsent < len(req_str):
+            sent = s.send(req_str[totalsent:])
+            if sent == 0:
+                self.logger.info("SENT 0, error in sending")
+                return False
+            totalsent += sent
+
+        response = struct.unpack("i", s.recv(struct.calcsize("i")))[0]
+        if (response != 0):
+            self.logger.error("SENT response non-zero: %d", response)
 
-            if NETWORK_DEBUG is not None:
-                self.logger.info("[Network Debug] Sent Python Request %d bytes "
-                    "to 127.0.0.1:%s\n%s\n", totalsent, self.remote_port, req_str)
+        s.close()
 
-            self.logger.debug("--> Sent Flex Request: %s" % req_str)
+        if NETWORK_DEBUG is not None and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("[Network Debug] Sent Python Request %d bytes "
+                "to 127.0.0.1:%s\n%s\n", totalsent, self.remote_port, payload_log.describe(req_str))
+        elif self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("--> Sent Flex Request: %s", payload_log.describe(req_str))
+        return True
+
+    def submit(self, convert=None):
+        """
+        Send the request without waiting for the response.  Returns a
+        RequestFuture that is completed from the connection handler thread
+        with the raw response, or with convert(response) when given.
+        """
+        future = RequestFuture(convert)
+        (uid, _) = self._register(future)
+        try:
+            if not self._send(uid):
+                raise RuntimeError('error sending request: %s' % self.request)
+        except Exception:
+            self.logger.exception("Error in FlexRequest.submit")
+            self._unregister(uid)
+            future.set_exception(sys.exc_info())
+        return future
+
+    def __call__(self):
+        (uid, pending) = self._register()
+
+        # only the GUI thread may pump Qt events while it waits, worker
+        # threads simply block on the condition
+        main_thread = _in_main_thread()
+
+        try:
+            if not self._send(uid):
+                return
 
             # wait for response to come through
-            try:
-                timeout = float(os.getenv(PHOTOSHOP_TIMEOUT, '300.0'))
-            except:
-                self.logger.error("Error setting timeout from %s: %s",
-                    PHOTOSHOP_TIMEOUT, os.getenv(PHOTOSHOP_TIMEOUT))
             tick_length = 0.1
-            num_ticks = math.ceil(timeout/tick_length)
-            for tick in range(0, int(num_ticks)):
-                if self.requests[uid]['responded']:
-                    break
-                # self.logger.error("Tick: %d" % tick)
-                self.requests[uid]['cond'].wait(timeout/num_ticks)
+            with pending['cond']:
+                while not pending['responded']:
+                    # re-read, progress updates push the deadline out
+                    remaining = pending['deadline'] - time.time()
+                    if remaining <= 0:
+                        break
+                    if not main_thread:
+                        pending['cond'].wait(remaining)
+                        continue
+                    pending['cond'].wait(min(tick_length, remaining))
 
-                # make sure QApplication has had a chance to process events:
-                QtGui.QApplication.processEvents()
+                    # make sure QApplication has had a chance to process events,
+                    # without holding the condition so responses are not blocked
+                    pending['cond'].release()
+                    try:
+                        QtGui.QApplication.processEvents()
+                    finally:
+                        pending['cond'].acquire()
 
-            if not self.requests[uid]['responded']:
-                self.logger.error("No response to: %s" % uid)
+                responded = pending['responded']
+
+            if not responded:
+                if not self.quiet:
+                    self.logger.error("No response to: %s", uid)
                 raise RuntimeError('timeout waiting for response: %s' % self.request)
 
             # response is now available, grab it
-            result = self.requests[uid]['response']
-            self.logger.debug("<-- Got Flex Response: %s" % result)
+            result = pending['response']
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("<-- Got Flex Response: %s", payload_log.describe(result or ''))
         except:
-            self.logger.exception("Error in FlexRequest.__call__")
+            if not self.quiet:
+                self.logger.exception("Error in FlexRequest.__call__")
             raise
         finally:
-            del self.requests[uid]
+            self._unregister(uid)
 
         return result
 
 
-def setup(remote_port, heartbeat_port):
-    FlexRequest.setup(remote_port, heartbeat_port)
+class RequestFuture(executor.Future):
+    """
+    Future for a submitted request.  Requests sent with 'stream' set may
+    report progress and partial results before the final response:
+
+        future = requestStream(request)
+        future.add_progress_callback(update_bar, main_thread=True)
+        for chunk in future.chunks():
+            process(chunk)
+        result = future.result()
+    """
+    def __init__(self, convert=None):
+        executor.Future.__init__(self)
+        self._convert = convert
+        self._progress = None
+        self._chunks = []
+        self._progress_callbacks = []
+
+    @property
+    def progress(self):
+        """
+        The last reported progress, between 0 and 1, or None.
+        """
+        return self._progress
+
+    def _complete(self, response):
+        if self._convert is None:
+            self.set_result(response)
+            return
+        try:
+            value = self._convert(response)
+        except Exception:
+            self.set_exception(sys.exc_info())
+        else:
+            self.set_result(value)
 
+    def _update(self, progress, message, chunk):
+        if chunk is not None:
+            try:
+                chunk = dictToPython(json.loads(chunk))
+            except Exception:
+                FlexRequest.logger.exception("Error decoding partial result")
+                chunk = None
+        with self._cond:
+            if progress is not None:
+                self._progress = progress
+            if chunk is not None:
+                self._chunks.append(chunk)
+            self._cond.notify_all()
+            callbacks = list(self._progress_callbacks)
+        for callback in callbacks:
+            try:
+                callback(self._progress, message, chunk)
+            except Exception:
+                FlexRequest.logger.exception("Error in progress callback %s", callback)
 
-def dictToPython(d):
-    # Boolean, Date, Error, Function, Vector, XML, XMLList
-    if d is None:
-        return None
-    if d['type'] in ['null', 'undefined']:
+    def add_progress_callback(self, fn, main_thread=False):
+        """
+        Call fn(progress, message, chunk) for every progress update, chunk
+        is the decoded partial result or None.
+        """
+        if main_thread:
+            callback = lambda *args: callback_event.send_to_main_thread(fn, *args)
+        else:
+            callback = fn
+        with self._cond:
+            self._progress_callbacks.append(callback)
+
+    def chunks(self, timeout=None):
+        """
+        Iterate over the partial results as they arrive, stopping once the
+        request completes.  Blocks, so use it from a worker thread.
+        """
+        index = 0
+        while True:
+            with self._cond:
+                deadline = None if timeout is None else time.time() + timeout
+                while index >= len(self._chunks) and not self._done:
+                    if deadline is not None and deadline <= time.time():
+                        raise executor.TimeoutError('timed out waiting for partial results')
+                    self._cond.wait(None if deadline is None else deadline - time.time())
+                if index >= len(self._chunks):
+                    return
+                chunk = self._chunks[index]
+            index += 1
+            yield chunk
+
+
+def _in_main_thread():
+    app = QtCore.QCoreApplication.instance()
+    if app is None:
+        return False
+    return QtCore.QThread.currentThread() == app.thread()
+
+
+def setup(remote_port, heartbeat_port, statics=(), handshake=False):
+    if os.getenv(PREFETCH):
+        enablePrefetch()
+    FlexRequest.setup(remote_port, heartbeat_port, statics, handshake)
+
+
+# the heartbeat ends the process with os._exit, which skips atexit, so
+# whatever has to happen at exit registers here as well
+_exit_hooks = []
+
+
+def add_exit_hook(fn):
+    """
+    Call fn before the heartbeat ends the process.  Hooks run newest first,
+    like atexit, then logging is shut down.
+    """
+    _exit_hooks.append(fn)
+
+
+# blob files left behind by the panel or never closed
+add_exit_hook(shared_memory._remove_owned)
+
+
+def _runExitHooks():
+    for fn in reversed(_exit_hooks):
+        try:
+            fn()
+        except Exception:
+            logger.exception("Error in exit hook %s", fn)
+    logging.shutdown()
+
+
+# adaptive attribute prefetch
+################################################################################
+class AttributePrefetcher(object):
+    """
+    Learns which properties are read from proxies created at the same site
+    (the declared class plus the accessor or method that returned them) and
+    asks for the likely set along with the object.
+
+    Prefetched values are only trusted until the next request that may have
+    changed the document (setprop, callmethod or objcreate).
+    """
+    THRESHOLD = 0.5
+    MIN_SAMPLES = 3
+    MAX_PROPS = 16
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._path = path
+        self._profile = {}
+        self._fetched = 0
+        self._hits = 0
+        self._logger = logging.getLogger('sgtk.photoshop.flexbase.AttributePrefetcher')
+        if path is not None:
+            self.load(path)
+
+    @staticmethod
+    def site_key(declared_cls, site):
+        return "%s|%s" % (declared_cls, site)
+
+    def predict(self, key):
+        with self._lock:
+            entry = self._profile.get(key)
+            if entry is None or entry['created'] < self.MIN_SAMPLES:
+                return []
+            created = float(entry['created'])
+            likely = [(count, name) for (name, count) in entry['reads'].iteritems()
+                if count/created >= self.THRESHOLD]
+        likely.sort(reverse=True)
+        return [name for (_, name) in likely[:self.MAX_PROPS]]
+
+    def record_created(self, key, fetched):
+        with self._lock:
+            entry = self._profile.setdefault(key, {'created': 0, 'reads': {}})
+            entry['created'] += 1
+            self._fetched += fetched
+
+    def record_read(self, key, prop, hit):
+        with self._lock:
+            reads = self._profile.setdefault(key, {'created': 0, 'reads': {}})['reads']
+            reads[prop] = reads.get(prop, 0) + 1
+            if hit:
+                self._hits += 1
+
+    def stats(self):
+        """
+        Returns how many values were prefetched, how many of them were used
+        and how many were wasted.
+        """
+        with self._lock:
+            return {
+                'fetched': self._fetched,
+                'hits': self._hits,
+                'waste': self._fetched - self._hits,
+                'hit_rate': self._hits/float(self._fetched) if self._fetched else 0.0,
+                'sites': len(self._profile),
+            }
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                profile = json.load(f)
+        except Exception:
+            self._logger.exception("Error loading prefetch profile %s", path)
+            return
+        with self._lock:
+            self._profile = profile
+
+    def save(self, path=None):
+        path = path or self._path
+        if path is None:
+            return
+        with self._lock:
+            data = json.dumps(self._profile)
+        try:
+            directory = os.path.dirname(path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(path, 'w') as f:
+                f.write(data)
+        except Exception:
+            self._logger.exception("Error saving prefetch profile %s", path)
+        self._logger.info("Prefetch stats: %s", self.stats())
+
+
+prefetcher = None
+
+
+def enablePrefetch(path=None):
+    global prefetcher
+    if prefetcher is not None:
+        return prefetcher
+    if path is None:
+        path = os.getenv(PREFETCH_PROFILE,
+            os.path.join(os.path.expanduser('~'), 'Library', 'Caches', 'Shotgun',
+                'tk-photoshop.prefetch.json'))
+    prefetcher = AttributePrefetcher(path)
+    atexit.register(prefetcher.save)
+    add_exit_hook(prefetcher.save)
+    return prefetcher
+
+
+# bumped by every request that may change the document, values fetched
+# ahead of time are only served while it is unchanged
+_mutations = itertools.count(1)
+_generation = 0
+
+
+def _noteMutation():
+    global _generation
+    _generation = next(_mutations)
+
+
+def _prefetchRequest(request, parent, member):
+    """
+    Ask for the properties likely to be read from the object a getprop or
+    callmethod request will return.  Returns the site key to track it by.
+    """
+    if prefetcher is None:
         return None
-    if d['type'] in ['String', 'Number', 'Boolean', 'int', 'uint']:
-        return d['value']
-    if d['type'] == 'Array':
-        return [dictToPython[e] for e in d['value']]
-    if d['type'] == 'RemoteObject':
-        return RemoteObject(d['cls'], uid=d['obj_uid'])
-    if d['type'] == 'error':
-        raise RuntimeError(d['stack'])
-    raise ValueError("Unknown reponse object '%s'", d)
+    declared = member.get('type') or member.get('returnType') or '*'
+    key = AttributePrefetcher.site_key(declared, "%s.%s" % (parent._cls, member.get('name')))
+    props = prefetcher.predict(key)
+    if props:
+        request['prefetch'] = props
+    return key
+
+
+def _prefetchResponse(key, results, value):
+    """
+    Keep the property values sent along with a RemoteObject result.
+    """
+    if not isinstance(value, RemoteObject):
+        return
+    props = results.get('props') or {}
+    generation = _generation
+    value._prefetched = dict((name, (generation, prop)) for (name, prop) in props.iteritems())
+    if key is not None:
+        value._site = key
+        prefetcher.record_created(key, len(props))
+
+
+# packed numeric arrays, sent as base64 of the little endian values
+################################################################################
+# wire dtype -> array.array typecode
+TYPED_ARRAY_TYPECODES = {
+    'i1': 'b', 'u1': 'B',
+    'i2': 'h', 'u2': 'H',
+    'i4': 'i', 'u4': 'I',
+    'f4': 'f', 'f8': 'd',
+}
+TYPED_ARRAY_DTYPES = dict((v, k) for (k, v) in TYPED_ARRAY_TYPECODES.iteritems())
+
+
+def typedArray(values, dtype='f8'):
+    """
+    Pack a sequence of numbers so it crosses the bridge as a TypedArray.
+    """
+    if dtype not in TYPED_ARRAY_TYPECODES:
+        raise ValueError("Unsupported typed array dtype '%s'" % dtype)
+    return array.array(TYPED_ARRAY_TYPECODES[dtype], values)
+
+
+def _decodeTypedArray(bridge_codec, d):
+    dtype = d['dtype']
+    if dtype not in TYPED_ARRAY_TYPECODES:
+        raise ValueError("Unsupported typed array dtype '%s'" % dtype)
+    data = base64.b64decode(d['value'])
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype='<' + dtype)
+    values = array.array(TYPED_ARRAY_TYPECODES[dtype])
+    values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _encodeTypedArray(bridge_codec, v):
+    bridge_codec.require('typed_arrays', v)
+    if numpy is not None and isinstance(v, numpy.ndarray):
+        dtype = '%s%d' % (v.dtype.kind, v.dtype.itemsize)
+        if dtype not in TYPED_ARRAY_TYPECODES:
+            raise ValueError("Unsupported typed array dtype '%s'" % v.dtype)
+        data = numpy.ascontiguousarray(v.ravel(), dtype='<' + dtype).tostring()
+        length = v.size
+    else:
+        dtype = TYPED_ARRAY_DTYPES.get(v.typecode)
+        if dtype is None or v.itemsize != int(dtype[1]):
+            raise ValueError("Unsupported array typecode '%s'" % v.typecode)
+        if sys.byteorder == 'big':
+            v = array.array(v.typecode, v)
+            v.byteswap()
+        data = v.tostring()
+        length = len(v)
+    return {'type': bridge_codec.tag('TypedArray'), 'dtype': dtype, 'length': length,
+        'value': base64.b64encode(data)}
+
+
+# value codec
+################################################################################
+def _encodeBlob(bridge_codec, v):
+    bridge_codec.require('blobs', v)
+    handle = v.handle()
+    handle['type'] = bridge_codec.tag('Blob')
+    return handle
+
+
+def _decodeBlob(bridge_codec, d):
+    # the received blob removes its file, never take anything else
+    if not shared_memory.in_blob_dir(d['path']):
+        raise ValueError("Blob outside of the blob folder: %s" % d['path'])
+    return shared_memory.Blob(d['path'], d['size'], d.get('offset', 0))
+
+
+def _encodeRemoteObject(bridge_codec, v):
+    return {'type': bridge_codec.tag('RemoteObject'), 'cls': v._cls, 'obj_uid': v._uid}
+
+
+def _decodeRemoteObject(bridge_codec, d):
+    return RemoteObject(d['cls'], uid=d['obj_uid'])
+
+
+def dictToPython(d):
+    return codec.default.decode(d)
 
 
 def pythonToDict(v):
-    if v is None:
-        return {'type': 'null'}
-    if isinstance(v, str) or isinstance(v, unicode):
-        return {'type': 'String', 'value': v}
-    if isinstance(v, bool):
-        return {'type': 'Boolean', 'value': v}
-    if isinstance(v, int):
-        return {'type': 'int', 'value': v}
-    if isinstance(v, float):
-        return {'type': 'Number', 'value': v}
-    if isinstance(v, (list, tuple)):
-        return {'type': 'Array', 'value': [pythonToDict(e) for e in v]}
-    if isinstance(v, RemoteObject):
-        return {'type': 'RemoteObject', 'cls': v._cls, 'obj_uid': v._uid}
-    raise ValueError("Unhandled python object (%s) '%s'" % (type(v), v))
+    return codec.default.encode(v)
 
 
 def requestSetMessage(message):
-    logger = logging.getLogger('sgtk.photoshop.flexbase')
     logger.debug("requestSetMessage('%s')", message)
     request = {
         'type': 'setmessage',
         'message': message,
     }
     FlexRequest(json.dumps(request))()
-    FlexRequest.callbacks.clear()
+    FlexRequest.clear_callbacks()
 
 
 def requestClearPanel():
-    logger = logging.getLogger('sgtk.photoshop.flexbase')
     logger.debug("requestClearPanel()")
     request = {'type': 'clearpanel'}
     FlexRequest(json.dumps(request))()
-    FlexRequest.callbacks.clear()
+    FlexRequest.clear_callbacks()
 
 
 def requestAddButton(label, callback):
-    logger = logging.getLogger('sgtk.photoshop.flexbase')
     logger.debug("requestAddButton('%s')", label)
     request = {
         'type': 'addbutton',
@@ -354,12 +1015,14 @@ def requestAddButton(label, callback):
     results = FlexRequest(json.dumps(request))()
     results = json.loads(results)
     results = dictToPython(results)
-    FlexRequest.callbacks[results] = callback
+    FlexRequest.set_callback(results, callback)
 
 
 def requestStatic(cls, prop):
-    logger = logging.getLogger('sgtk.photoshop.flexbase')
     logger.debug("requestStatic('%s', '%s')", cls, prop)
+    if (cls, prop) in FlexRequest.startup:
+        # fetched during the handshake, only served once
+        return FlexRequest.startup.pop((cls, prop))
     request = {
         'type': 'static',
         'cls': cls,
@@ -371,7 +1034,6 @@ def requestStatic(cls, prop):
 
 
 def requestClassDesc(cls):
-    logger = logging.getLogger('sgtk.photoshop.flexbase')
     logger.debug("requestClassDesc('%s')", cls)
     request = {
         'type': 'classdef',
@@ -385,12 +1047,94 @@ def requestClassDesc(cls):
     return dom
 
 
+# non-blocking requests, the returned futures complete on a connection
+# handler thread with the decoded result
+################################################################################
+def _decodeResponse(response):
+    return dictToPython(json.loads(response))
+
+
+def requestAsync(request):
+    return FlexRequest(json.dumps(request)).submit(_decodeResponse)
+
+
+def requestStream(request):
+    """
+    Submit a request asking the panel to stream progress and partial results
+    back, see RequestFuture.
+    """
+    request = dict(request, stream=True)
+    return requestAsync(request)
+
+
+def requestStaticAsync(cls, prop):
+    request = {
+        'type': 'static',
+        'cls': cls,
+        'prop': prop,
+    }
+    return requestAsync(request)
+
+
+def requestGetPropAsync(obj, prop):
+    accessor = obj._find_accessor(prop)
+    if accessor is None:
+        raise AttributeError("unknown property '%s'" % prop)
+    if accessor.get('access') == 'writeonly':
+        raise ValueError("attempting to access writeonly property '%s'" % prop)
+    request = {
+        'type': 'getprop',
+        'obj': pythonToDict(obj),
+        'prop': prop,
+    }
+    return requestAsync(request)
+
+
+def requestSetPropAsync(obj, prop, value):
+    accessor = obj._find_accessor(prop)
+    if accessor is None:
+        raise AttributeError("unknown property '%s'" % prop)
+    if accessor.get('access') == 'readonly':
+        raise ValueError("attempting to set a readonly property '%s'" % prop)
+    request = {
+        'type': 'setprop',
+        'obj': pythonToDict(obj),
+        'prop': prop,
+        'value': pythonToDict(value),
+    }
+    _noteMutation()
+    return requestAsync(request)
+
+
+def requestCallMethodAsync(obj, method, *args, **kwargs):
+    """
+    Pass stream=True to get progress and partial results for long running
+    methods.
+    """
+    stream = kwargs.pop('stream', False)
+    if kwargs:
+        raise ValueError('unknown arguments: %s' % kwargs)
+    if obj._find_method(method) is None:
+        raise AttributeError("unknown method '%s'" % method)
+    request = {
+        'type': 'callmethod',
+        'obj': pythonToDict(obj),
+        'method': method,
+        'args': pythonToDict(args)
+    }
+    _noteMutation()
+    if stream:
+        return requestStream(request)
+    return requestAsync(request)
+
+
 class RemoteObject(object):
     """A wrapper around a flex object"""
     classMap = {}
+    classMapLock = threading.Lock()
+    _logger = logging.getLogger('sgtk.photoshop.flexbase.RemoteObject')
 
     def __init__(self, cls, *args, **kwargs):
-        self._logger = logging.getLogger('sgtk.photoshop.flexbase.RemoteObject')
         if 'uid' in kwargs:
             uid = kwargs['uid']
             del kwargs['uid']
@@ -400,7 +1144,10 @@ class RemoteObject(object):
         if kwargs:
             raise ValueError('unknown arguments to __init__: %s' % kwargs)
         self._cls = cls
-        self._dom = self.classMap.setdefault(cls, requestClassDesc(cls))
+        self._dom = self._get_class_desc(cls)
+        self._site = None
+        self._prefetched = {}
+        self._read = set()
         if uid is not None and args:
             raise ValueError('cannot specify both uid and init args')
         if uid is not None:
@@ -412,11 +1159,39 @@ class RemoteObject(object):
                 'cls': cls,
                 'args': pythonToDict(args)
             }
+            _noteMutation()
             results = FlexRequest(json.dumps(request))()
             results = json.loads(results)
-            self._logger.debug("Remote Object Constructor Returned: %s" % results)
             self._uid = results['obj_uid']
 
+    @classmethod
+    def preload_class_desc(cls, name, dom):
+        with cls.classMapLock:
+            cls.classMap.setdefault(name, dom)
+
+    @classmethod
+    def _get_class_desc(cls, name):
+        with cls.classMapLock:
+            dom = cls.classMap.get(name)
+        if dom is None:
+            # fetched outside the lock, a racing thread just does the same work
+            dom = requestClassDesc(name)
+            with cls.classMapLock:
+                dom = cls.classMap.setdefault(name, dom)
+        return dom
+
+    def _find_accessor(self, attr):
+        for candidate in self._dom.findall('factory/accessor'):
+            if candidate.get('name') == attr:
+                return candidate
+        return None
+
+    def _find_method(self, attr):
+        for candidate in self._dom.findall('factory/method'):
+            if candidate.get('name') == attr:
+                return candidate
+        return None
+
     def __repr__(self):
         return "<%s %s>" % (self._cls, self._uid)
 
@@ -428,12 +1203,7 @@ class RemoteObject(object):
         self._logger.debug("%s.__setattr__(%s, %s)", self, attr, value)
 
         # check if attr is an accessor
-        accessor = None
-        accessors = self._dom.findall('factory/accessor')
-        for candidate in accessors:
-            if candidate.get('name') == attr:
-                accessor = candidate
-                break
+        accessor = self._find_accessor(attr)
         if accessor is not None:
             if accessor.get('access') == 'readonly':
                 raise ValueError("attempting to set a readonly property '%s'" % attr)
@@ -443,6 +1213,7 @@ class RemoteObject(object):
                 'prop': attr,
                 'value': pythonToDict(value),
             }
+            _noteMutation()
             results = FlexRequest(json.dumps(request))()
 
             # check results in case an error occurred
@@ -455,43 +1226,190 @@ class RemoteObject(object):
             raise AttributeError("%s has no attribute '%s'" % (cls, attr))
 
         # check if attr is an accessor
-        accessor = None
-        accessors = self._dom.findall('factory/accessor')
-        for candidate in accessors:
-            if candidate.get('name') == attr:
-                accessor = candidate
-                break
+        accessor = self._find_accessor(attr)
         if accessor is not None:
             if accessor.get('access') == 'writeonly':
                 raise ValueError("attempting to access writeonly property '%s'" % attr)
+
+            # serve the value from the prefetched set when it is still current
+            prefetched = self._prefetched.pop(attr, None)
+            hit = prefetched is not None and prefetched[0] == _generation
+            if self._site is not None and attr not in self._read:
+                self._read.add(attr)
+                prefetcher.record_read(self._site, attr, hit)
+            if hit:
+                self._logger.debug("__getattr__(%s) = %s (prefetched)", attr, prefetched[1])
+                return dictToPython(prefetched[1])
+
             request = {
                 'type': 'getprop',
                 'obj': pythonToDict(self),
                 'prop': attr,
             }
+            key = _prefetchRequest(request, self, accessor)
             results = FlexRequest(json.dumps(request))()
             results = json.loads(results)
-            self._logger.debug("__getattr__(%s) = %s", attr, results)
-            return dictToPython(results)
+            self._logger.debug("__getattr__(%s)", attr)
+            value = dictToPython(results)
+            _prefetchResponse(key, results, value)
+            return value
 
         # check if attr is a method
-        method = None
-        methods = self._dom.findall('factory/method')
-        for candidate in methods:
-            if candidate.get('name') == attr:
-                method = candidate
-                break
+        method = self._find_method(attr)
         if method is not None:
             return RemoteMethod(self, method)
 
         raise AttributeError("unknown attribute '%s'" % attr)
 
 
+class PipelinedRef(object):
+    """
+    The not yet returned result of a chain of remote operations.
+
+    Attribute access and calls on a reference build up the chain locally,
+    whether a hop is a property or a method is only known once the next hop
+    is made.  resolve() then sends every step in a single request, each step
+    refers to the previous result by a placeholder obj_uid that the panel
+    fills in as it evaluates the chain in order:
+
+        bounds = pipeline(app).activeDocument.layers.getByName('BG').bounds
+        resolve(bounds)
+    """
+    def __init__(self, root=None, parent=None, name=None, args=None):
+        self._root = root
+        self._parent = parent
+        self._name = name
+        self._args = args
+
+    def __repr__(self):
+        if self._parent is None:
+            return "<pipeline %r>" % (self._root, )
+        if self._args is None:
+            return "%r.%s" % (self._parent, self._name)
+        return "%r.%s(...)" % (self._parent, self._name)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError("pipelined reference has no attribute '%s'" % attr)
+        return PipelinedRef(parent=self, name=attr)
+
+    def __call__(self, *args):
+        if self._parent is None or self._args is not None:
+            raise TypeError("%r is not callable" % self)
+        return PipelinedRef(parent=self._parent, name=self._name, args=args)
+
+
+def _compilePipeline(refs):
+    """
+    Flatten the chains behind refs into an ordered list of requests, shared
+    prefixes are only evaluated once.
+    """
+    placeholders = {}
+    steps = []
+
+    # same tags as the values pythonToDict encodes into the request
+    tag = codec.default.tag
+
+    def encode(value):
+        if isinstance(value, PipelinedRef):
+            if value._parent is None:
+                # the root is a real object, not a step result
+                return pythonToDict(value._root)
+            return {'type': tag('RemoteObject'), 'cls': None, 'obj_uid': visit(value)}
+        if isinstance(value, (list, tuple)):
+            return {'type': tag('Array'), 'value': [encode(e) for e in value]}
+        return pythonToDict(value)
+
+    def visit(ref):
+        if id(ref) in placeholders:
+            return placeholders[id(ref)]
+        if ref._parent is None:
+            placeholders[id(ref)] = None
+            return None
+        parent_uid = visit(ref._parent)
+        if parent_uid is None:
+            obj = pythonToDict(ref._parent._root)
+        else:
+            obj = {'type': tag('RemoteObject'), 'cls': None, 'obj_uid': parent_uid}
+        if ref._args is None:
+            step = {'type': 'getprop', 'obj': obj, 'prop': ref._name}
+        else:
+            step = {'type': 'callmethod', 'obj': obj, 'method': ref._name,
+                'args': encode(ref._args)}
+        uid = 'pipeline:%s' % uuid.uuid4()
+        step['result_uid'] = uid
+        steps.append(step)
+        placeholders[id(ref)] = uid
+        return uid
+
+    results = []
+    for ref in refs:
+        if ref._parent is None:
+            raise ValueError("nothing to resolve on %r" % ref)
+        results.append(visit(ref))
+    return (steps, results)
+
+
+def _resolveLocally(refs):
+    """
+    Evaluate pipelined references one hop per round trip, for panels that
+    cannot run a pipeline.
+    """
+    values = {}
+
+    def evaluate(value):
+        if isinstance(value, PipelinedRef):
+            return visit(value)
+        if isinstance(value, (list, tuple)):
+            return [evaluate(e) for e in value]
+        return value
+
+    def visit(ref):
+        if id(ref) in values:
+            return values[id(ref)]
+        if ref._parent is None:
+            value = ref._root
+        elif ref._args is None:
+            value = getattr(visit(ref._parent), ref._name)
+        else:
+            value = getattr(visit(ref._parent), ref._name)(*evaluate(ref._args))
+        values[id(ref)] = value
+        return value
+
+    results = []
+    for ref in refs:
+        if ref._parent is None:
+            raise ValueError("nothing to resolve on %r" % ref)
+        results.append(visit(ref))
+    return results
+
+
+def requestPipeline(refs):
+    """
+    Resolve pipelined references in one round trip, returns their values in
+    order.
+    """
+    logger.debug("requestPipeline(%s)", refs)
+    if not FlexRequest.supports('pipeline'):
+        return _resolveLocally(refs)
+    (steps, results) = _compilePipeline(refs)
+    request = {
+        'type': 'pipeline',
+        'requests': steps,
+        'results': results,
+    }
+    _noteMutation()
+    values = FlexRequest(json.dumps(request))()
+    values = json.loads(values)
+    return dictToPython(values)
+
+
 class RemoteMethod(object):
+    _logger = logging.getLogger('sgtk.photoshop.flexbase.RemoteMethod')
+
     def __init__(self, parent, method):
         self._parent = parent
         self._method = method
-        self._logger = logging.getLogger('sgtk.photoshop.flexbase.RemoteMethod')
 
     def __call__(self, *args):
         name = self._method.get('name')
@@ -501,7 +1419,23 @@ class RemoteMethod(object):
             'method': name,
             'args': pythonToDict(args)
         }
+        key = _prefetchRequest(request, self._parent, self._method)
+        _noteMutation()
         results = FlexRequest(json.dumps(request))()
         results = json.loads(results)
-        self._logger.debug("%s(%s) = %s", name, args, results)
-        return dictToPython(results)
+        self._logger.debug("%s(%s)", name, args)
+        value = dictToPython(results)
+        _prefetchResponse(key, results, value)
+        return value
+
+
+codec.default.register_encoder(array.array, _encodeTypedArray)
+if numpy is not None:
+    codec.default.register_encoder(numpy.ndarray, _encodeTypedArray)
+codec.default.register_decoder('TypedArray', _decodeTypedArray)
+codec.default.register_encoder(shared_memory.Blob, _encodeBlob)
+codec.default.register_decoder('Blob', _decodeBlob)
+codec.default.register_encoder(RemoteObject, _encodeRemoteObject)
+codec.default.register_decoder('RemoteObject', _decodeRemoteObject)
+# only what legacy panels decode, until the handshake says otherwise
+codec.default.features = FlexRequest.capabilities.features
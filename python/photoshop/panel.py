@@ -0,0 +1,157 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Declarative panel layouts.
+
+The whole panel is described locally and sent in a single 'setpanel'
+request instead of a clearpanel plus one addbutton round trip per button:
+
+    layout = PanelLayout()
+    section = layout.add_section('context', 'Context')
+    section.add_button('Jump to Shotgun', jump_to_sg)
+    set_panel(layout)
+
+Button ids are derived from the section id and label, so they are stable
+across rebuilds.  When a layout was sent before, only the sections that
+changed travel in an 'updatepanel' request.  Callbacks only live on the
+python side and are swapped without a round trip.
+"""
+import json
+import logging
+import threading
+
+from . import flexbase
+
+logger = logging.getLogger('sgtk.photoshop.panel')
+
+
+class PanelSection(object):
+    def __init__(self, id, label):
+        self.id = id
+        self.label = label
+        self.buttons = []
+
+    def add_button(self, label, callback):
+        button_id = '%s/%s' % (self.id, label)
+        self.buttons.append((button_id, label, callback))
+        return button_id
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'label': self.label,
+            'buttons': [{'id': b, 'label': l} for (b, l, _) in self.buttons],
+        }
+
+
+class PanelLayout(object):
+    def __init__(self):
+        self.sections = []
+
+    def add_section(self, id, label=None):
+        section = PanelSection(id, label)
+        self.sections.append(section)
+        return section
+
+    def callbacks(self):
+        callbacks = {}
+        for section in self.sections:
+            for (button_id, _, callback) in section.buttons:
+                callbacks[button_id] = callback
+        return callbacks
+
+    def to_dict(self):
+        return [section.to_dict() for section in self.sections]
+
+
+def diff_layouts(old, new):
+    """
+    Returns the changes that turn the old layout description (a list of
+    section dicts) into the new one, or None when the section order changed
+    and the layout has to be sent whole.
+    """
+    old_ids = [s['id'] for s in old]
+    new_ids = [s['id'] for s in new]
+    kept = [i for i in new_ids if i in old_ids]
+    if kept != [i for i in old_ids if i in new_ids]:
+        return None
+
+    old_by_id = dict((s['id'], s) for s in old)
+    new_id_set = set(new_ids)
+    changes = [{'op': 'remove', 'id': i} for i in old_ids if i not in new_id_set]
+    previous = None
+    for section in new:
+        current = old_by_id.get(section['id'])
+        if current is None:
+            changes.append({'op': 'insert', 'after': previous, 'section': section})
+        elif current != section:
+            changes.append({'op': 'replace', 'section': section})
+        previous = section['id']
+    return changes
+
+
+# the layout currently shown by the panel, None when unknown
+_lock = threading.Lock()
+_sent = None
+
+
+def invalidate():
+    """
+    Forget the last sent layout, the next set_panel sends everything.
+    """
+    global _sent
+    with _lock:
+        _sent = None
+
+
+def set_panel(layout):
+    """
+    Show layout (a PanelLayout) in the panel.
+    """
+    global _sent
+    description = layout.to_dict()
+    callbacks = layout.callbacks()
+
+    if not flexbase.FlexRequest.supports('setpanel'):
+        _add_buttons(layout)
+        return
+
+    with _lock:
+        sent = _sent
+    changes = diff_layouts(sent, description) if sent is not None else None
+    if changes is None:
+        logger.debug("set_panel(%d sections)", len(description))
+        request = {'type': 'setpanel', 'sections': description}
+    elif changes:
+        logger.debug("set_panel(%d changes)", len(changes))
+        request = {'type': 'updatepanel', 'changes': changes}
+    else:
+        request = None
+
+    if request is not None:
+        try:
+            results = flexbase.FlexRequest(json.dumps(request))()
+            flexbase.dictToPython(json.loads(results))
+        except Exception:
+            invalidate()
+            raise
+    with _lock:
+        _sent = description
+    flexbase.FlexRequest.replace_callbacks(callbacks)
+
+
+def _add_buttons(layout):
+    # older panels, one request per button and no sections
+    logger.debug("set_panel() without setpanel support, adding buttons one by one")
+    flexbase.requestClearPanel()
+    for section in layout.sections:
+        for (_, label, callback) in section.buttons:
+            flexbase.requestAddButton(label, callback)
@@ -0,0 +1,170 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Local analysis of layer and document pixels.
+
+The pixels are fetched in a single request as an 8 bit RGBA blob, then
+checks such as empty layer detection, alpha coverage, histograms and tight
+bounds run locally.  NumPy is used when available, otherwise the checks fall
+back to string operations that still run at C speed.
+"""
+import json
+import logging
+
+from . import flexbase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('sgtk.photoshop.pixels')
+
+
+def get_pixels(obj):
+    """
+    Fetch the pixels of a layer or document (a RemoteObject) in one transfer.
+    """
+    logger.debug("get_pixels(%s)", obj)
+    flexbase.FlexRequest.require('pixels')
+    request = {
+        'type': 'pixels',
+        'obj': flexbase.pythonToDict(obj),
+        'format': 'RGBA8',
+    }
+    results = flexbase.FlexRequest(json.dumps(request))()
+    results = json.loads(results)
+    if results.get('type') == 'error':
+        flexbase.dictToPython(results)
+    blob = flexbase.dictToPython(results['data'])
+    return PixelData(results['width'], results['height'], blob,
+        tuple(results.get('origin', (0, 0))))
+
+
+class PixelData(object):
+    """
+    Interleaved 8 bit RGBA pixels.  origin is the position of the top left
+    pixel in the document, bounds are reported in document coordinates.
+
+    Use it as a context manager, or call close(), to release the shared
+    blob as soon as the checks are done.
+    """
+    CHANNELS = 4
+
+    def __init__(self, width, height, blob, origin=(0, 0)):
+        self.width = width
+        self.height = height
+        self.origin = origin
+        self._blob = blob
+        self._bytes = None
+
+    def close(self):
+        self._blob.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def array(self):
+        """
+        Returns a (height, width, 4) uint8 NumPy view of the pixels.
+        """
+        return self._blob.array('u1').reshape((self.height, self.width, self.CHANNELS))
+
+    def _channel_bytes(self, channel):
+        # slicing a str with a step runs in C, it is the fallback's workhorse
+        if self._bytes is None:
+            self._bytes = self._blob.tobytes()
+        return self._bytes[channel::self.CHANNELS]
+
+    def is_empty(self):
+        """
+        True if every pixel is fully transparent.
+        """
+        if numpy is not None:
+            return not self.array()[:, :, 3].any()
+        return not self._channel_bytes(3).strip('\0')
+
+    def alpha_coverage(self):
+        """
+        Fraction of pixels that are not fully transparent.
+        """
+        count = self.width * self.height
+        if count == 0:
+            return 0.0
+        if numpy is not None:
+            covered = numpy.count_nonzero(self.array()[:, :, 3])
+        else:
+            alpha = self._channel_bytes(3)
+            covered = len(alpha) - alpha.count('\0')
+        return covered / float(count)
+
+    def histograms(self):
+        """
+        Returns a list of four 256 bin histograms, one per RGBA channel.
+        """
+        if numpy is not None:
+            pixels = self.array()
+            return [numpy.bincount(pixels[:, :, c].ravel(), minlength=256).tolist()
+                for c in range(self.CHANNELS)]
+        results = []
+        for c in range(self.CHANNELS):
+            # one pass over the channel, not one count() per value
+            counts = [0] * 256
+            for value in bytearray(self._channel_bytes(c)):
+                counts[value] += 1
+            results.append(counts)
+        return results
+
+    def tight_bounds(self):
+        """
+        Returns the (left, top, right, bottom) box around the non transparent
+        pixels in document coordinates, or None for an empty layer.
+        """
+        if numpy is not None:
+            alpha = self.array()[:, :, 3]
+            rows = numpy.flatnonzero(alpha.any(axis=1))
+            if not len(rows):
+                return None
+            cols = numpy.flatnonzero(alpha.any(axis=0))
+            (top, bottom) = (int(rows[0]), int(rows[-1]) + 1)
+            (left, right) = (int(cols[0]), int(cols[-1]) + 1)
+        else:
+            alpha = self._channel_bytes(3)
+            (left, top, right, bottom) = (self.width, None, 0, None)
+            for y in xrange(self.height):
+                row = alpha[y*self.width:(y + 1)*self.width]
+                stripped = row.lstrip('\0')
+                if not stripped:
+                    continue
+                if top is None:
+                    top = y
+                bottom = y + 1
+                left = min(left, self.width - len(stripped))
+                right = max(right, len(row.rstrip('\0')))
+            if top is None:
+                return None
+        (x, y) = self.origin
+        return (left + x, top + y, right + x, bottom + y)
+
+    def summary(self):
+        """
+        Run the common QC checks in one go.
+        """
+        return {
+            'width': self.width,
+            'height': self.height,
+            'empty': self.is_empty(),
+            'alpha_coverage': self.alpha_coverage(),
+            'bounds': self.tight_bounds(),
+        }
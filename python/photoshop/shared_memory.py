@@ -0,0 +1,184 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Out of band transport for bulk binary data such as layer pixels, thumbnails
+or exported PNG bytes.
+
+The bytes live in a memory mapped temp file and only a small handle
+({'type': 'Blob', 'path': ..., 'offset': ..., 'size': ...}) crosses the
+socket.  Whoever receives a blob owns the file and removes it on close().
+Files of blobs that are dropped without close() are removed when the blob
+is collected, or at exit where the platform refuses to remove a file that
+is still mapped.
+"""
+import os
+import mmap
+import uuid
+import atexit
+import logging
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    _memoryview = memoryview
+except NameError:
+    # python 2.6
+    _memoryview = None
+
+BLOB_DIR = 'SGTK_PHOTOSHOP_BLOB_DIR'
+
+logger = logging.getLogger('sgtk.photoshop.shared_memory')
+
+# files owned by blobs that were not closed yet
+_owned = set()
+
+
+def _remove_owned():
+    for path in list(_owned):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    _owned.clear()
+
+atexit.register(_remove_owned)
+
+
+def blob_dir():
+    path = os.getenv(BLOB_DIR, os.path.join(tempfile.gettempdir(), 'sgtk_photoshop_blobs'))
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+def in_blob_dir(path):
+    """
+    True if path, with links resolved, is inside blob_dir().  Only those
+    files may be owned (and so removed) by a received blob.
+    """
+    root = os.path.normcase(os.path.realpath(blob_dir()))
+    path = os.path.normcase(os.path.realpath(path))
+    return path.startswith(root + os.sep)
+
+
+class Blob(object):
+    """
+    A read only mapping over a region of a file shared with the panel.
+    """
+    def __init__(self, path, size, offset=0, owner=True):
+        self.path = path
+        self.size = size
+        self.offset = offset
+        self._owner = owner
+        self._file = None
+        self._map = None
+        if owner:
+            _owned.add(path)
+
+    @classmethod
+    def create(cls, data):
+        """
+        Write data (any object supporting the buffer interface) into a new
+        shared file.  The receiving side takes ownership of the file.
+        """
+        path = os.path.join(blob_dir(), '%s.blob' % uuid.uuid4())
+        with open(path, 'wb') as f:
+            f.write(data)
+        return cls(path, len(data), owner=False)
+
+    def handle(self):
+        return {'type': 'Blob', 'path': self.path, 'offset': self.offset, 'size': self.size}
+
+    def _mapping(self):
+        if self._map is None:
+            self._file = open(self.path, 'rb')
+            if self.size == 0:
+                self._map = ''
+            else:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def view(self):
+        """
+        Returns a zero copy view of the bytes.  A memoryview where the mapping
+        supports it, otherwise a read only buffer.
+        """
+        mapping = self._mapping()
+        if _memoryview is None:
+            return buffer(mapping, self.offset, self.size)
+        try:
+            view = _memoryview(mapping)
+        except TypeError:
+            # mmap only has the old style buffer interface on python 2
+            return buffer(mapping, self.offset, self.size)
+        return view[self.offset:self.offset + self.size]
+
+    def array(self, dtype='u1'):
+        """
+        Returns a zero copy NumPy view of the bytes.  Needs NumPy.
+        """
+        if numpy is None:
+            raise RuntimeError('NumPy is not available')
+        itemsize = numpy.dtype(dtype).itemsize
+        return numpy.frombuffer(self._mapping(), dtype=dtype,
+            count=self.size//itemsize, offset=self.offset)
+
+    def tobytes(self):
+        view = self.view()
+        if _memoryview is not None and isinstance(view, _memoryview):
+            return view.tobytes()
+        return str(view)
+
+    def close(self):
+        """
+        Release the mapping, removing the file when this side owns it.  Views
+        returned earlier must not be used afterwards.
+        """
+        if self._map is not None:
+            if not isinstance(self._map, str):
+                self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+        if self._owner and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                logger.exception("Error removing blob file %s", self.path)
+        if self._owner:
+            _owned.discard(self.path)
+
+    def __del__(self):
+        # the mapping may still back views handed out, leave it open and
+        # only try to remove the file, _remove_owned retries at exit
+        try:
+            if self._owner and self.path in _owned:
+                os.remove(self.path)
+                _owned.discard(self.path)
+        except Exception:
+            # also at interpreter shutdown, when module globals are gone
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return "<Blob %s (%d bytes)>" % (self.path, self.size)
@@ -0,0 +1,533 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Whole document layer trees in one request.
+
+The panel walks the layer hierarchy in a single pass and returns it as
+plain JSON:
+
+    {'id': 12, 'name': 'shot.psd', 'width': 1920, 'height': 1080, 'seq': 40,
+     'layers': [{'id': 3, 'name': 'BG', 'kind': 'ArtLayer', 'visible': true,
+                 'opacity': 100.0, 'blendMode': 'NORMAL',
+                 'bounds': [0, 0, 1920, 1080], 'layers': [...]}, ...]}
+
+which becomes an immutable local tree indexed by layer id, name and path,
+so reading it needs no further round trips.
+
+A DocumentModel keeps a snapshot current from the panel's change
+notifications, 'documentChanged' app events carrying:
+
+    {'doc': 12, 'seq': 41, 'changes': [
+        {'op': 'update', 'id': 3, 'props': {'name': 'BG', 'visible': false}},
+        {'op': 'insert', 'parent': 2, 'index': 0, 'layer': {...}},
+        {'op': 'remove', 'id': 5},
+        {'op': 'move', 'id': 4, 'parent': null, 'index': 1}]}
+
+Only the affected subtrees are rebuilt.  A gap in the sequence numbers or a
+change that cannot be applied marks the model stale and the next read does
+a full resync.  The snapshot reply carries the seq of the last change it
+includes; notifications that arrive while a resync is in flight are held
+and the newer ones applied on top of the fetched snapshot.
+"""
+import json
+import logging
+import threading
+
+from . import flexbase
+
+logger = logging.getLogger('sgtk.photoshop.snapshot')
+
+
+class _Immutable(object):
+    __slots__ = ()
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __delattr__(self, attr):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+
+class LayerNode(_Immutable):
+    """
+    One layer or layer group.  path is the tuple of names from the top of
+    the document down to this layer.
+    """
+    __slots__ = ('id', 'name', 'kind', 'visible', 'opacity', 'blend_mode',
+        'bounds', 'parent_id', 'path', 'children')
+
+    def __init__(self, id, name, kind, visible, opacity, blend_mode, bounds,
+            parent_id, path, children):
+        set_attr = object.__setattr__
+        set_attr(self, 'id', id)
+        set_attr(self, 'name', name)
+        set_attr(self, 'kind', kind)
+        set_attr(self, 'visible', visible)
+        set_attr(self, 'opacity', opacity)
+        set_attr(self, 'blend_mode', blend_mode)
+        set_attr(self, 'bounds', bounds)
+        set_attr(self, 'parent_id', parent_id)
+        set_attr(self, 'path', path)
+        set_attr(self, 'children', children)
+
+    @property
+    def is_group(self):
+        return self.kind == 'LayerSet'
+
+    def __repr__(self):
+        return "<LayerNode %s '%s'>" % (self.id, '/'.join(self.path))
+
+
+# panel property names -> LayerNode attributes
+LAYER_PROPS = {
+    'name': 'name',
+    'kind': 'kind',
+    'visible': 'visible',
+    'opacity': 'opacity',
+    'blendMode': 'blend_mode',
+    'bounds': 'bounds',
+}
+
+
+def copy_layer(layer, **changes):
+    fields = dict((attr, getattr(layer, attr)) for attr in LayerNode.__slots__)
+    fields.update(changes)
+    return LayerNode(**fields)
+
+
+def build_layer(data, parent_id, parent_path):
+    """
+    Build a LayerNode and its children from the panel's JSON description.
+    """
+    path = parent_path + (data['name'], )
+    children = tuple(build_layer(child, data['id'], path)
+        for child in data.get('layers', ()))
+    bounds = data.get('bounds')
+    return LayerNode(data['id'], data['name'], data.get('kind'), data.get('visible'),
+        data.get('opacity'), data.get('blendMode'),
+        tuple(bounds) if bounds is not None else None,
+        parent_id, path, children)
+
+
+class DocumentSnapshot(_Immutable):
+    """
+    An immutable copy of a document's layer tree with O(1) lookups by layer
+    id, name and path.
+    """
+    __slots__ = ('id', 'name', 'width', 'height', 'layers',
+        '_by_id', '_by_name', '_by_path')
+
+    def __init__(self, id, name, width, height, layers):
+        set_attr = object.__setattr__
+        set_attr(self, 'id', id)
+        set_attr(self, 'name', name)
+        set_attr(self, 'width', width)
+        set_attr(self, 'height', height)
+        set_attr(self, 'layers', layers)
+        by_id = {}
+        by_name = {}
+        by_path = {}
+        for layer in self._walk(layers):
+            by_id[layer.id] = layer
+            by_name.setdefault(layer.name, []).append(layer)
+            by_path[layer.path] = layer
+        set_attr(self, '_by_id', by_id)
+        set_attr(self, '_by_name', dict((k, tuple(v)) for (k, v) in by_name.iteritems()))
+        set_attr(self, '_by_path', by_path)
+
+    @classmethod
+    def _from_indexes(cls, id, name, width, height, layers, by_id, by_name, by_path):
+        snapshot = object.__new__(cls)
+        set_attr = object.__setattr__
+        for (attr, value) in (('id', id), ('name', name), ('width', width),
+                ('height', height), ('layers', layers), ('_by_id', by_id),
+                ('_by_name', by_name), ('_by_path', by_path)):
+            set_attr(snapshot, attr, value)
+        return snapshot
+
+    @classmethod
+    def from_json(cls, data):
+        layers = tuple(build_layer(layer, None, ()) for layer in data.get('layers', ()))
+        return cls(data.get('id'), data.get('name'), data.get('width'),
+            data.get('height'), layers)
+
+    @staticmethod
+    def _walk(layers):
+        stack = list(reversed(layers))
+        while stack:
+            layer = stack.pop()
+            yield layer
+            stack.extend(reversed(layer.children))
+
+    def walk(self):
+        """
+        Iterate over every layer, depth first in panel order.
+        """
+        return self._walk(self.layers)
+
+    def layer(self, layer_id):
+        """
+        Returns the layer with the given id, or None.
+        """
+        return self._by_id.get(layer_id)
+
+    def layers_named(self, name):
+        """
+        Returns a tuple of all the layers with the given name.
+        """
+        return self._by_name.get(name, ())
+
+    def find(self, path):
+        """
+        Returns the layer at path, a tuple of names or a '/' separated string.
+        """
+        if isinstance(path, basestring):
+            path = tuple(path.split('/'))
+        return self._by_path.get(tuple(path))
+
+    def parent(self, layer):
+        if layer.parent_id is None:
+            return None
+        return self._by_id.get(layer.parent_id)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, layer_id):
+        return layer_id in self._by_id
+
+    def __repr__(self):
+        return "<DocumentSnapshot '%s' (%d layers)>" % (self.name, len(self))
+
+
+class PatchError(Exception):
+    pass
+
+
+class _SnapshotPatch(object):
+    """
+    Applies change notifications to a snapshot.  The indexes are copied,
+    replaced layers and their ancestors are rebuilt and every other node is
+    shared with the original snapshot.
+    """
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._layers = snapshot.layers
+        self._by_id = dict(snapshot._by_id)
+        self._by_name = dict(snapshot._by_name)
+        self._by_path = dict(snapshot._by_path)
+
+    def result(self):
+        snapshot = self._snapshot
+        return DocumentSnapshot._from_indexes(snapshot.id, snapshot.name,
+            snapshot.width, snapshot.height, self._layers,
+            self._by_id, self._by_name, self._by_path)
+
+    # indexes
+    def _index(self, layer):
+        self._by_id[layer.id] = layer
+        named = self._by_name.get(layer.name, ())
+        self._by_name[layer.name] = tuple(n for n in named if n.id != layer.id) + (layer, )
+        self._by_path[layer.path] = layer
+
+    def _unindex(self, layer):
+        self._by_id.pop(layer.id, None)
+        named = tuple(n for n in self._by_name.get(layer.name, ()) if n.id != layer.id)
+        if named:
+            self._by_name[layer.name] = named
+        else:
+            self._by_name.pop(layer.name, None)
+        if self._by_path.get(layer.path) is layer:
+            del self._by_path[layer.path]
+
+    def _layer(self, layer_id):
+        layer = self._by_id.get(layer_id)
+        if layer is None:
+            raise PatchError("unknown layer %s" % layer_id)
+        return layer
+
+    def _path(self, parent_id):
+        if parent_id is None:
+            return ()
+        return self._layer(parent_id).path
+
+    def _children(self, parent_id):
+        if parent_id is None:
+            return self._layers
+        return self._layer(parent_id).children
+
+    # tree edits
+    def _set_children(self, parent_id, children):
+        """
+        Swap in a new children tuple, rebuilding the ancestors up to the top.
+        """
+        while parent_id is not None:
+            parent = self._layer(parent_id)
+            replacement = copy_layer(parent, children=children)
+            self._unindex(parent)
+            self._index(replacement)
+            children = tuple(replacement if n.id == parent_id else n
+                for n in self._children(parent.parent_id))
+            parent_id = parent.parent_id
+        self._layers = children
+
+    def _reparent(self, layer, parent_id, parent_path):
+        """
+        Rebuild a subtree whose path changed, reindexing all of it.
+        """
+        path = parent_path + (layer.name, )
+        children = tuple(self._reparent(child, layer.id, path) for child in layer.children)
+        replacement = copy_layer(layer, parent_id=parent_id, path=path, children=children)
+        self._unindex(layer)
+        self._index(replacement)
+        return replacement
+
+    def _walk(self, layer):
+        return DocumentSnapshot._walk((layer, ))
+
+    def update(self, layer_id, props):
+        layer = self._layer(layer_id)
+        changes = {}
+        for (key, value) in props.iteritems():
+            if key not in LAYER_PROPS:
+                raise PatchError("unknown layer property %s" % key)
+            if key == 'bounds' and value is not None:
+                value = tuple(value)
+            changes[LAYER_PROPS[key]] = value
+        replacement = copy_layer(layer, **changes)
+        self._unindex(layer)
+        if replacement.name != layer.name:
+            # the paths of the whole subtree change with the name
+            replacement = self._reparent(replacement, layer.parent_id, self._path(layer.parent_id))
+        else:
+            self._index(replacement)
+        self._set_children(layer.parent_id, tuple(replacement if n.id == layer_id else n
+            for n in self._children(layer.parent_id)))
+
+    def insert(self, parent_id, index, data):
+        layer = build_layer(data, parent_id, self._path(parent_id))
+        if layer.id in self._by_id:
+            raise PatchError("layer %s already exists" % layer.id)
+        for node in self._walk(layer):
+            self._index(node)
+        children = list(self._children(parent_id))
+        children.insert(index, layer)
+        self._set_children(parent_id, tuple(children))
+
+    def remove(self, layer_id):
+        layer = self._layer(layer_id)
+        for node in self._walk(layer):
+            self._unindex(node)
+        self._set_children(layer.parent_id, tuple(n for n in self._children(layer.parent_id)
+            if n.id != layer_id))
+
+    def move(self, layer_id, parent_id, index):
+        layer = self._layer(layer_id)
+        ancestor_id = parent_id
+        while ancestor_id is not None:
+            if ancestor_id == layer_id:
+                raise PatchError("cannot move layer %s into itself" % layer_id)
+            ancestor_id = self._layer(ancestor_id).parent_id
+        self._set_children(layer.parent_id, tuple(n for n in self._children(layer.parent_id)
+            if n.id != layer_id))
+        layer = self._reparent(layer, parent_id, self._path(parent_id))
+        children = list(self._children(parent_id))
+        children.insert(index, layer)
+        self._set_children(parent_id, tuple(children))
+
+    def apply(self, change):
+        op = change.get('op')
+        if op == 'update':
+            self.update(change['id'], change['props'])
+        elif op == 'insert':
+            self.insert(change.get('parent'), change['index'], change['layer'])
+        elif op == 'remove':
+            self.remove(change['id'])
+        elif op == 'move':
+            self.move(change['id'], change.get('parent'), change['index'])
+        else:
+            raise PatchError("unknown change %s" % op)
+
+
+class DocumentModel(object):
+    """
+    A cached snapshot of one document kept current by change notifications.
+    version is bumped every time the cached snapshot changes.
+    """
+    def __init__(self, doc):
+        self._doc = doc
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+        self._seq = None
+        self._stale = True
+        # notifications received while a resync is in flight
+        self._resyncing = 0
+        self._held = []
+        self.resync()
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def stale(self):
+        return self._stale
+
+    @property
+    def id(self):
+        return self._snapshot.id if self._snapshot is not None else None
+
+    def snapshot(self):
+        """
+        Returns the current snapshot, resyncing first if changes were missed.
+        """
+        if self._stale:
+            self.resync()
+        return self._snapshot
+
+    def resync(self):
+        with self._lock:
+            self._resyncing += 1
+        snapshot = None
+        try:
+            (snapshot, seq) = _fetch_snapshot(self._doc, watch=True)
+        finally:
+            with self._lock:
+                self._resyncing -= 1
+                held = self._held
+                if not self._resyncing:
+                    self._held = []
+                if snapshot is not None:
+                    self._snapshot = snapshot
+                    self._seq = seq
+                    self._stale = False
+                    self._version += 1
+                    # seq is None from panels that do not report it, then
+                    # there is no telling which held changes it includes
+                    if seq is not None:
+                        for data in sorted(held, key=lambda d: d.get('seq')):
+                            if data.get('seq') is not None and data['seq'] > seq:
+                                self._apply(data)
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def apply(self, data):
+        """
+        Patch the cached snapshot with one change notification.
+        """
+        with self._lock:
+            if self._resyncing:
+                self._held.append(data)
+                return
+            self._apply(data)
+
+    def _apply(self, data):
+        # called with the lock held
+        if self._stale:
+            return
+        seq = data.get('seq')
+        if self._seq is not None and seq is not None and seq != self._seq + 1:
+            logger.debug("missed changes to document %s (%s -> %s)", self.id, self._seq, seq)
+            self._stale = True
+            return
+        patch = _SnapshotPatch(self._snapshot)
+        try:
+            for change in data.get('changes', ()):
+                patch.apply(change)
+        except (PatchError, KeyError, IndexError):
+            logger.debug("could not patch document %s, resyncing", self.id, exc_info=True)
+            self._stale = True
+            return
+        self._snapshot = patch.result()
+        self._seq = seq
+        self._version += 1
+
+
+# document id -> model, the notifications name documents by id
+_models = {}
+# RemoteObject uid -> model, so lookups do not read doc.id (a round trip)
+_models_by_uid = {}
+_models_lock = threading.Lock()
+_listening = False
+
+
+def _handle_event(event, data):
+    if event not in ('documentChanged', 'documentClosed') or not data:
+        return
+    with _models_lock:
+        model = _models.get(data.get('doc'))
+        if event == 'documentClosed':
+            _models.pop(data.get('doc'), None)
+            for (uid, cached) in _models_by_uid.items():
+                if cached is model:
+                    del _models_by_uid[uid]
+    if model is None:
+        return
+    if event == 'documentClosed':
+        model.invalidate()
+    else:
+        model.apply(data)
+
+
+def get_document_model(doc):
+    """
+    Returns the cached DocumentModel for doc (a RemoteObject), creating it
+    and asking the panel for change notifications on first use.
+
+    Models are found by the RemoteObject's uid without a round trip.  Only a
+    proxy not seen before costs reading doc.id from the panel.
+    """
+    global _listening
+    with _models_lock:
+        if not _listening:
+            flexbase.FlexRequest.add_event_listener(_handle_event)
+            _listening = True
+        model = _models_by_uid.get(doc._uid)
+    if model is not None:
+        return model
+    doc_id = doc.id
+    with _models_lock:
+        model = _models.get(doc_id)
+        if model is not None:
+            _models_by_uid[doc._uid] = model
+            return model
+    model = DocumentModel(doc)
+    with _models_lock:
+        model = _models.setdefault(model.id, model)
+        _models_by_uid[doc._uid] = model
+        return model
+
+
+def get_snapshot(doc, watch=False):
+    """
+    Fetch the layer tree of doc (a RemoteObject) in one round trip.  With
+    watch the panel also starts sending change notifications for it.
+    """
+    return _fetch_snapshot(doc, watch)[0]
+
+
+def _fetch_snapshot(doc, watch):
+    # returns (snapshot, seq of the last change it includes or None)
+    logger.debug("get_snapshot(%s)", doc)
+    flexbase.FlexRequest.require('snapshot')
+    request = {
+        'type': 'snapshot',
+        'obj': flexbase.pythonToDict(doc),
+        'watch': watch,
+    }
+    results = flexbase.FlexRequest(json.dumps(request))()
+    results = json.loads(results)
+    if results.get('type') == 'error':
+        flexbase.dictToPython(results)
+    return (DocumentSnapshot.from_json(results), results.get('seq'))
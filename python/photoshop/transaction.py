@@ -0,0 +1,171 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Transactional blocks for bulk DOM edits.
+
+    with photoshop.transaction('Rename layers') as t:
+        for layer in layers:
+            t.set(layer, 'name', layer.name.lower())
+            t.call(layer, 'translate', 10, 0)
+    moved = t.results
+
+Edits are queued with set(), call() and action() and sent in a single
+'transaction' request when the block exits, the same way pipeline and
+executeactions batch their steps.  Reads inside the block go out as usual
+and do not see the queued edits.  Nothing is sent when the block raises.
+Nested blocks on the same thread queue into the outermost transaction.
+
+On the host the panel builds one script from the steps and runs it with
+app.activeDocument.suspendHistory(name, script), the only way Photoshop
+groups edits into one history state; suspendHistory runs the script
+synchronously, which is why the steps have to arrive together.  With
+suppress_redraw the panel switches the playback performance option to
+accelerated around the call and restores the previous option afterwards.
+When a step fails the script stops there, and with rollback_on_error the
+panel returns the document to the history state it had before.
+
+Panels without the 'transaction' request get the steps one request at a
+time when the block exits, each edit then is its own history state.  This
+is logged as a warning the first time it happens, and the transaction's
+grouped attribute is False.
+"""
+import json
+import logging
+import threading
+
+from . import flexbase
+from . import action_manager
+
+logger = logging.getLogger('sgtk.photoshop.transaction')
+
+_local = threading.local()
+
+# only warn once per session about panels without transactions
+_warned = False
+
+
+class Transaction(object):
+    def __init__(self, name, suppress_redraw=True, rollback_on_error=False):
+        self.name = name
+        self.suppress_redraw = suppress_redraw
+        self.rollback_on_error = rollback_on_error
+        # the queued steps, as (request, run it on its own)
+        self._steps = []
+        self._outer = None
+        # decoded step results once the block exited, see the module docs
+        self.results = None
+        self.grouped = False
+
+    ##########################################################################################
+    # queueing
+
+    def set(self, obj, prop, value):
+        """
+        Queue obj.prop = value.
+        """
+        request = {
+            'type': 'setprop',
+            'obj': flexbase.pythonToDict(obj),
+            'prop': prop,
+            'value': flexbase.pythonToDict(value),
+        }
+        self._queue(request, lambda: setattr(obj, prop, value))
+
+    def call(self, obj, method, *args):
+        """
+        Queue obj.method(*args), its result is in results after the block.
+        """
+        request = {
+            'type': 'callmethod',
+            'obj': flexbase.pythonToDict(obj),
+            'method': method,
+            'args': flexbase.pythonToDict(args),
+        }
+        self._queue(request, lambda: getattr(obj, method)(*args))
+
+    def action(self, event, descriptor=None, dialog_mode='no'):
+        """
+        Queue an executeAction, see action_manager.execute_action.
+        """
+        if dialog_mode not in action_manager.DIALOG_MODES:
+            raise ValueError("dialog_mode must be one of %s" % (action_manager.DIALOG_MODES, ))
+        request = {
+            'type': 'executeaction',
+            'event': action_manager._encode_id(event),
+            'descriptor': descriptor.to_dict() if descriptor is not None else None,
+            'dialog_mode': dialog_mode,
+        }
+        self._queue(request, lambda: action_manager.execute_action(event, descriptor, dialog_mode))
+
+    def _queue(self, request, run):
+        target = self._outer or self
+        target._steps.append((request, run))
+
+    ##########################################################################################
+    # context manager
+
+    def __enter__(self):
+        self._outer = getattr(_local, 'current', None)
+        if self._outer is None:
+            _local.current = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._outer is not None:
+            # the outermost transaction sends everything
+            return False
+        _local.current = None
+        steps = self._steps
+        self._steps = []
+        if exc_type is not None:
+            logger.debug("transaction '%s' raised, %d steps not sent", self.name, len(steps))
+            return False
+        if not steps:
+            self.results = []
+            return False
+        if flexbase.FlexRequest.supports('transaction'):
+            self.results = self._send(steps)
+            self.grouped = True
+        else:
+            self.results = self._run_one_by_one(steps)
+        return False
+
+    def _send(self, steps):
+        logger.debug("transaction '%s' (%d steps)", self.name, len(steps))
+        request = {
+            'type': 'transaction',
+            'name': self.name,
+            'suppress_redraw': self.suppress_redraw,
+            'rollback': self.rollback_on_error,
+            'steps': [step for (step, _) in steps],
+        }
+        try:
+            results = flexbase.FlexRequest(json.dumps(request))()
+        finally:
+            # a rollback changes the document behind any prefetched values
+            flexbase._noteMutation()
+        results = json.loads(results)
+        if results.get('type') == 'error':
+            flexbase.dictToPython(results)
+        action_manager._update_ids(results.get('ids', {}))
+        return [flexbase.dictToPython(result) for result in results.get('results', ())]
+
+    def _run_one_by_one(self, steps):
+        # older panels, edits are applied one by one as before
+        global _warned
+        if not _warned:
+            _warned = True
+            logger.warning("The installed Photoshop panel does not support transactions, "
+                "edits in '%s' and later transactions are not grouped into one history state",
+                self.name)
+        else:
+            logger.debug("transactions not supported, running '%s' without one", self.name)
+        return [run() for (_, run) in steps]
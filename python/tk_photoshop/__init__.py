@@ -9,3 +9,6 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 from .panel_generation import PanelGenerator
+from .command_registry import CommandRegistry
+from .dialog_manager import DialogManager
+from .dialog_warmer import DialogWarmer
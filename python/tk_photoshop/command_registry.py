@@ -0,0 +1,202 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Indexed view of the engine commands
+
+"""
+import unicodedata
+
+
+class CommandRegistry(object):
+    """
+    Wraps engine.commands in AppCommands once and indexes them by name, app,
+    type and app instance name.
+
+    Lookups only read the index.  Call refresh() once before a batch of
+    lookups (e.g. at the start of a panel build), it rebuilds the index when
+    the engine context or the set of registered commands changed.
+    """
+    def __init__(self, engine):
+        self._engine = engine
+        self._signature = None
+        self._commands = []
+        self._by_name = {}
+        self._by_app = {}
+        self._by_type = {}
+        self._by_instance_name = {}
+
+    ##########################################################################################
+    # public methods
+
+    def commands(self):
+        """
+        Returns all AppCommands, in engine.commands order
+        """
+        self._refresh()
+        return list(self._commands)
+
+    def get(self, name):
+        """
+        Returns the AppCommand for a command name or None
+        """
+        self._refresh()
+        return self._by_name.get(name)
+
+    def by_app(self, app_name):
+        """
+        Returns the AppCommands of an app by display name, None for
+        commands that do not belong to an app
+        """
+        self._refresh()
+        return list(self._by_app.get(app_name, ()))
+
+    def by_type(self, cmd_type):
+        """
+        Returns the AppCommands of a type, see AppCommand.get_type
+        """
+        self._refresh()
+        return list(self._by_type.get(cmd_type, ()))
+
+    def by_instance_name(self, instance_name):
+        """
+        Returns the AppCommands of an app instance, as named in the environment
+        """
+        self._refresh()
+        return list(self._by_instance_name.get(instance_name, ()))
+
+    def app_names(self):
+        self._refresh()
+        return [name for name in self._by_app if name is not None]
+
+    def refresh(self):
+        """
+        Rebuild the index if the engine context or commands changed since
+        the last build.
+        """
+        signature = self._current_signature()
+        if signature != self._signature:
+            self._build(signature)
+
+    def invalidate(self):
+        """
+        Drop the index, the next lookup rebuilds it.
+        """
+        self._signature = None
+
+    ##########################################################################################
+    # index
+
+    def _current_signature(self):
+        commands = self._engine.commands
+        return (id(self._engine.context), id(commands), len(commands), frozenset(commands))
+
+    def _refresh(self):
+        # lookups never compare signatures, that is O(commands) each time
+        if self._signature is None:
+            self._build(self._current_signature())
+
+    def _build(self, signature):
+        # app instance -> name, so each command resolves its instance name
+        # with a lookup instead of a scan over engine.apps
+        instance_names = dict((id(app), name) for (name, app) in self._engine.apps.items())
+
+        commands = []
+        by_name = {}
+        by_app = {}
+        by_type = {}
+        by_instance_name = {}
+        for (cmd_name, cmd_details) in self._engine.commands.items():
+            app = cmd_details["properties"].get("app")
+            instance_name = instance_names.get(id(app)) if app is not None else None
+            cmd = AppCommand(cmd_name, cmd_details, instance_name)
+            commands.append(cmd)
+            by_name[cmd_name] = cmd
+            by_app.setdefault(cmd.get_app_name(), []).append(cmd)
+            by_type.setdefault(cmd.get_type(), []).append(cmd)
+            if instance_name is not None:
+                by_instance_name.setdefault(instance_name, []).append(cmd)
+
+        self._commands = commands
+        self._by_name = by_name
+        self._by_app = by_app
+        self._by_type = by_type
+        self._by_instance_name = by_instance_name
+        self._signature = signature
+        self._engine.log_debug("Indexed %d commands", len(commands))
+
+
+class AppCommand(object):
+    """
+    Wraps around a single command that you get from engine.commands
+    """
+    _NOT_RESOLVED = object()
+
+    def __init__(self, name, command_dict, instance_name=_NOT_RESOLVED):
+        self.name = name
+        self.properties = command_dict["properties"]
+        self.callback = command_dict["callback"]
+        self._instance_name = instance_name
+
+    def get_app_name(self):
+        """
+        Returns the name of the app that this command belongs to
+        """
+        if "app" in self.properties:
+            return self.properties["app"].display_name
+        return None
+
+    def get_app_instance_name(self):
+        """
+        Returns the name of the app instance, as defined in the environment.
+        Returns None if not found.
+        """
+        if self._instance_name is not self._NOT_RESOLVED:
+            # resolved by the registry
+            return self._instance_name
+
+        if "app" not in self.properties:
+            return None
+
+        app_instance = self.properties["app"]
+        engine = app_instance.engine
+
+        for (app_instance_name, app_instance_obj) in engine.apps.items():
+            if app_instance_obj == app_instance:
+                # found our app!
+                self._instance_name = app_instance_name
+                return app_instance_name
+        return None
+
+    def get_documentation_url_str(self):
+        """
+        Returns the documentation as a str
+        """
+        if "app" in self.properties:
+            app = self.properties["app"]
+            doc_url = app.documentation_url
+            # deal with nuke's inability to handle unicode. #fail
+            if doc_url.__class__ == unicode:
+                doc_url = unicodedata.normalize('NFKD', doc_url).encode('ascii', 'ignore')
+            return doc_url
+
+        return None
+
+    def get_type(self):
+        """
+        returns the command type. Returns node, custom_pane or default
+        """
+        return self.properties.get("type", "default")
+
+    def add_button(self, section):
+        """
+        Adds an app command to a section of the panel layout
+        """
+        section.add_button(self.name, self.callback)
@@ -0,0 +1,157 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Lifetime management for dialogs shown by the engine
+
+"""
+import collections
+
+
+class DialogManager(object):
+    """
+    Keeps the dialogs created by show_dialog and show_modal alive while
+    they are open, and a bounded number of closed ones after that.
+
+    Deleting a dialog from python while Qt still has events queued for it
+    crashes Photoshop, so dialogs are never dropped directly.  Released
+    dialogs are handed to deleteLater, which runs once the pending events
+    have been processed, and the python reference is only dropped when Qt
+    reports the dialog destroyed.
+
+    With reuse enabled a closed dialog is shown again instead of building a
+    new one, when the widget class, title, bundle and (hashable) arguments
+    match.
+    """
+    def __init__(self, engine, max_retained=8, reuse=False):
+        self._engine = engine
+        # the most recent dialog is always kept, show_modal callers still
+        # read from its widget after it closed
+        self.max_retained = max(1, max_retained)
+        self.reuse = reuse
+        # dialog -> reuse key, for dialogs currently shown
+        self._open = {}
+        # dialog -> the widget_class instance it holds
+        self._widgets = {}
+        # reuse key -> closed dialog, and the keys oldest first
+        self._closed = {}
+        self._closed_order = collections.deque()
+        # closed dialogs without a usable key, oldest first
+        self._closed_unkeyed = collections.deque()
+        # released dialogs waiting for Qt to delete them
+        self._releasing = set()
+        # reuse key -> dialog built ahead of time and never shown
+        self._warm = {}
+
+    ##########################################################################################
+    # public methods
+
+    def make_key(self, title, bundle, widget_class, args, kwargs):
+        """
+        Returns the reuse key for a dialog, or None when the arguments
+        cannot be compared.
+        """
+        try:
+            key = (widget_class, title, id(bundle), tuple(args), frozenset(kwargs.items()))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get_or_create(self, title, bundle, widget_class, *args, **kwargs):
+        """
+        Returns (dialog, widget), reusing a closed dialog when allowed.
+        """
+        key = self.make_key(title, bundle, widget_class, args, kwargs)
+        if key is not None and key in self._warm:
+            dialog = self._warm.pop(key)
+            self._engine.log_debug("Using pre-built dialog '%s'", title)
+            self._open[dialog] = key
+            return (dialog, self._widgets[dialog])
+        if self.reuse and key is not None and key in self._closed:
+            dialog = self._closed.pop(key)
+            self._closed_order.remove(key)
+            self._engine.log_debug("Reusing dialog '%s'", title)
+            self._open[dialog] = key
+            return (dialog, self._widgets[dialog])
+
+        (dialog, widget) = self._engine._create_dialog_with_widget(title, bundle, widget_class, *args, **kwargs)
+        self.track(dialog, widget, key)
+        return (dialog, widget)
+
+    def track(self, dialog, widget, key=None):
+        """
+        Take ownership of a dialog, it is retained while open.
+        """
+        self._open[dialog] = key
+        self._widgets[dialog] = widget
+        dialog.finished.connect(lambda result, dialog=dialog: self._on_closed(dialog))
+
+    def prebuild(self, title, bundle, widget_class, *args, **kwargs):
+        """
+        Build a hidden dialog for a later get_or_create with the same
+        arguments.
+        """
+        key = self.make_key(title, bundle, widget_class, args, kwargs)
+        if key is None or key in self._warm:
+            return
+        (dialog, widget) = self._engine._create_dialog_with_widget(title, bundle, widget_class, *args, **kwargs)
+        self._widgets[dialog] = widget
+        dialog.finished.connect(lambda result, dialog=dialog: self._on_closed(dialog))
+        self._warm[key] = dialog
+
+    def release_all(self):
+        for dialog in list(self._closed.values()) + list(self._closed_unkeyed) + self._warm.values():
+            self._release(dialog)
+        self._closed.clear()
+        self._closed_order.clear()
+        self._closed_unkeyed.clear()
+        self._warm.clear()
+
+    def stats(self):
+        return {
+            'open': len(self._open),
+            'retained': len(self._closed) + len(self._closed_unkeyed),
+            'warm': len(self._warm),
+            'releasing': len(self._releasing),
+        }
+
+    ##########################################################################################
+    # lifetime
+
+    def _on_closed(self, dialog):
+        if dialog not in self._open:
+            return
+        key = self._open.pop(dialog)
+        if self.reuse and key is not None:
+            previous = self._closed.pop(key, None)
+            if previous is not None:
+                self._closed_order.remove(key)
+                self._release(previous)
+            self._closed[key] = dialog
+            self._closed_order.append(key)
+        else:
+            self._closed_unkeyed.append(dialog)
+        self._trim()
+
+    def _trim(self):
+        while len(self._closed) + len(self._closed_unkeyed) > self.max_retained:
+            # unkeyed dialogs cannot be reused, drop those first
+            if self._closed_unkeyed:
+                dialog = self._closed_unkeyed.popleft()
+            else:
+                dialog = self._closed.pop(self._closed_order.popleft())
+            self._release(dialog)
+
+    def _release(self, dialog):
+        self._widgets.pop(dialog, None)
+        self._releasing.add(dialog)
+        dialog.destroyed.connect(lambda *args: self._releasing.discard(dialog))
+        dialog.deleteLater()
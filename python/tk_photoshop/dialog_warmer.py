@@ -0,0 +1,178 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pre-built dialogs for the most used apps
+
+"""
+import sys
+import json
+
+import tank
+
+# a dialog is only worth warming once it was opened this often
+MIN_USES = 3
+# keep the usage table small, the least used entries are dropped
+MAX_ENTRIES = 50
+
+
+class DialogWarmer(object):
+    """
+    Counts how often each dialog is opened through show_dialog, across
+    sessions (in QSettings), and after startup builds hidden instances of
+    the most used ones, one per idle pass of the event loop.  show_dialog
+    then picks the instance up from the DialogManager instead of building
+    the widget tree while the user waits.
+
+    Dialogs are recorded by the module path of the widget class (without
+    the per session prefix toolkit adds to app modules), the title, the app
+    instance name and the arguments.  The class is looked up again under the
+    recorded app's own imported package, so a module of the same name in
+    another app is never picked up.  Only dialogs whose arguments are the
+    app itself or plain JSON values can be rebuilt.
+    """
+    def __init__(self, engine, manager, count):
+        self._engine = engine
+        self._manager = manager
+        self.count = count
+        from tank.platform.qt import QtCore
+        self._settings = QtCore.QSettings("Shotgun Software", "tk-photoshop.dialog_usage")
+        try:
+            self._usage = json.loads(self._settings.value("usage") or "{}")
+        except (TypeError, ValueError):
+            self._usage = {}
+        self._queue = []
+
+    ##########################################################################################
+    # usage
+
+    def record_use(self, title, bundle, widget_class, args, kwargs):
+        spec = self._make_spec(title, bundle, widget_class, args, kwargs)
+        if spec is None:
+            return
+        key = json.dumps(spec, sort_keys=True)
+        entry = self._usage.setdefault(key, {'spec': spec, 'uses': 0})
+        entry['uses'] += 1
+        if len(self._usage) > MAX_ENTRIES:
+            least = min((k for k in self._usage if k != key), key=lambda k: self._usage[k]['uses'])
+            del self._usage[least]
+        self._settings.setValue("usage", json.dumps(self._usage))
+
+    def _make_spec(self, title, bundle, widget_class, args, kwargs):
+        instance_name = None
+        for (name, app) in self._engine.apps.items():
+            if app is bundle:
+                instance_name = name
+                break
+        if instance_name is None:
+            return None
+
+        def encode(value):
+            if value is bundle:
+                return {'bundle': True}
+            json.dumps(value)
+            return {'value': value}
+
+        try:
+            return {
+                'module': _strip_session_prefix(widget_class.__module__),
+                'class': widget_class.__name__,
+                'title': title,
+                'app': instance_name,
+                'args': [encode(a) for a in args],
+                'kwargs': dict((k, encode(v)) for (k, v) in kwargs.iteritems()),
+            }
+        except (TypeError, ValueError):
+            # not rebuildable from settings, do not count it
+            return None
+
+    ##########################################################################################
+    # warm up
+
+    def start(self, delay=2000):
+        """
+        Queue the most used dialogs and start building them once the event
+        loop has been idle for delay ms.
+        """
+        if self.count <= 0:
+            return
+        entries = sorted(self._usage.itervalues(), key=lambda e: -e['uses'])
+        self._queue = [e['spec'] for e in entries if e['uses'] >= MIN_USES][:self.count]
+        if self._queue:
+            from tank.platform.qt import QtCore
+            QtCore.QTimer.singleShot(delay, self._build_next)
+
+    def _build_next(self):
+        if not self._queue:
+            return
+        spec = self._queue.pop(0)
+        try:
+            self._build(spec)
+        except Exception:
+            self._engine.log_exception("Could not pre-build dialog '%s'", spec['title'])
+        if self._queue:
+            # one dialog per pass, pending events are handled in between
+            from tank.platform.qt import QtCore
+            QtCore.QTimer.singleShot(0, self._build_next)
+
+    def _build(self, spec):
+        bundle = self._engine.apps.get(spec['app'])
+        widget_class = None
+        if bundle is not None:
+            widget_class = _find_class(bundle, spec['module'], spec['class'])
+        if widget_class is None:
+            self._engine.log_debug("Dialog '%s' is not available in this environment", spec['title'])
+            return
+
+        def decode(value):
+            if value.get('bundle'):
+                return bundle
+            return value['value']
+
+        args = [decode(a) for a in spec['args']]
+        kwargs = dict((str(k), decode(v)) for (k, v) in spec['kwargs'].iteritems())
+        self._engine.log_debug("Pre-building dialog '%s'", spec['title'])
+        self._manager.prebuild(spec['title'], bundle, widget_class, *args, **kwargs)
+
+
+def _strip_session_prefix(module_name):
+    # toolkit imports each app under a unique top level name
+    (head, _, tail) = module_name.partition('.')
+    if head.startswith('tkimp') and tail:
+        return tail
+    return module_name
+
+
+def _find_class(bundle, module_name, class_name):
+    # the bundle hands back its already imported package, which carries
+    # this session's prefix for the app
+    package_name = module_name.partition('.')[0]
+    try:
+        package = bundle.import_module(package_name)
+    except (tank.TankError, ImportError):
+        package = None
+    if package is not None and package.__name__.endswith('.' + package_name):
+        prefix = package.__name__[:-len(package_name)]
+        module = _import(prefix + module_name)
+    else:
+        # not part of the app, framework or engine classes keep their name
+        module = sys.modules.get(module_name)
+    if module is None:
+        return None
+    return getattr(module, class_name, None)
+
+
+def _import(name):
+    if name not in sys.modules:
+        try:
+            __import__(name)
+        except ImportError:
+            return None
+    return sys.modules.get(name)
@@ -0,0 +1,162 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+In memory store for log records, indexed by level and logger name.
+
+Records get increasing sequence numbers.  The store keeps the last limit
+records in a list (with a moving start offset, so lookups by sequence
+number are constant time), and one list of sequence numbers per level and
+per logger.  Queries start from whichever source is smallest and check the
+remaining conditions record by record.
+
+Not thread safe, the log console only touches it from the main thread.
+"""
+import bisect
+import itertools
+import collections
+
+LogEntry = collections.namedtuple('LogEntry',
+    ['seq', 'created', 'levelno', 'levelname', 'name', 'thread', 'text', 'lower'])
+
+
+def make_entry(record, text):
+    """
+    Returns a LogEntry (without a sequence number yet) for a logging record
+    and its formatted text.
+    """
+    return LogEntry(None, record.created, record.levelno, record.levelname,
+        record.name, record.threadName, text, text.lower())
+
+
+class LogStore(object):
+    def __init__(self, limit):
+        self.limit = limit
+        self._records = []
+        self._start = 0
+        self._base = 0
+        self._next = 0
+        self._by_level = {}
+        self._by_logger = {}
+
+    def __len__(self):
+        return len(self._records) - self._start
+
+    @property
+    def first_seq(self):
+        return self._base
+
+    @property
+    def next_seq(self):
+        return self._next
+
+    def get(self, seq):
+        return self._records[self._start + seq - self._base]
+
+    def at(self, row):
+        return self._records[self._start + row]
+
+    def levels(self):
+        return sorted(self._by_level)
+
+    def logger_names(self):
+        return sorted(self._by_logger)
+
+    def extend(self, entries):
+        """
+        Add entries, dropping the oldest records past the limit.  Returns
+        (added, evicted) lists of sequence numbers.
+        """
+        entries = entries[-self.limit:]
+        evicted = self.evict(len(self) + len(entries) - self.limit)
+        added = []
+        for entry in entries:
+            entry = entry._replace(seq=self._next)
+            self._next += 1
+            self._records.append(entry)
+            self._by_level.setdefault(entry.levelno, []).append(entry.seq)
+            self._by_logger.setdefault(entry.name, []).append(entry.seq)
+            added.append(entry.seq)
+        return (added, evicted)
+
+    def evict(self, count):
+        """
+        Drop the oldest count records, returns their sequence numbers.
+        """
+        count = min(count, len(self))
+        if count <= 0:
+            return []
+        # newest evicted seq per key, so each index is trimmed once
+        evicted = []
+        levels = {}
+        loggers = {}
+        for entry in self._records[self._start:self._start + count]:
+            evicted.append(entry.seq)
+            levels[entry.levelno] = entry.seq
+            loggers[entry.name] = entry.seq
+        for (level, seq) in levels.iteritems():
+            self._trim(self._by_level, level, seq)
+        for (name, seq) in loggers.iteritems():
+            self._trim(self._by_logger, name, seq)
+        self._start += count
+        self._base += count
+        # compact once the dead prefix is as large as the live records
+        if self._start >= self.limit:
+            del self._records[:self._start]
+            self._start = 0
+        return evicted
+
+    def _trim(self, index, key, seq):
+        seqs = index[key]
+        if seqs[-1] <= seq:
+            del index[key]
+        else:
+            del seqs[:bisect.bisect_right(seqs, seq)]
+
+    def query(self, min_level=None, logger=None, text=None):
+        """
+        Returns the sequence numbers of the records at min_level or above,
+        from logger or its children, whose text contains text (case
+        insensitive), in order.  None matches everything.
+        """
+        sources = []
+        if min_level is not None:
+            sources.append([seqs for (level, seqs) in self._by_level.iteritems() if level >= min_level])
+        if logger:
+            prefix = logger + '.'
+            sources.append([seqs for (name, seqs) in self._by_logger.iteritems()
+                if name == logger or name.startswith(prefix)])
+
+        records = self._records
+        offset = self._start - self._base
+        if sources:
+            # walk the smallest index, the lists are sorted runs
+            smallest = min(sources, key=lambda lists: sum(len(seqs) for seqs in lists))
+            candidates = (records[offset + seq] for seq in sorted(itertools.chain(*smallest)))
+        else:
+            candidates = itertools.islice(records, self._start, None)
+
+        if min_level is not None:
+            candidates = (r for r in candidates if r.levelno >= min_level)
+        if logger:
+            candidates = (r for r in candidates if r.name == logger or r.name.startswith(prefix))
+        if text:
+            text = text.lower()
+            return [r.seq for r in candidates if text in r.lower]
+        return [r.seq for r in candidates]
+
+    def matches(self, entry, min_level=None, logger=None, text=None):
+        if min_level is not None and entry.levelno < min_level:
+            return False
+        if logger and entry.name != logger and not entry.name.startswith(logger + '.'):
+            return False
+        if text and text.lower() not in entry.lower:
+            return False
+        return True
@@ -9,71 +9,251 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 # log console
-import cgi
+#
+# records are formatted and buffered by the handler on the log pipeline
+# thread (see bootstrap/log_pipeline.py) and moved into an indexed log store
+# by a timer on the main thread, at most every FLUSH_INTERVAL ms.  the list
+# view shows all records or the ones matching the level, logger and search
+# filters, and only paints the visible rows.
+import os
+import bisect
 import logging
-import photoshop
+import itertools
+import collections
 
 from PySide import QtGui
 from PySide import QtCore
 
+from . import log_store
+
+LOG_LINES = 'SGTK_PHOTOSHOP_LOG_LINES'
+DEFAULT_LOG_LINES = 5000
+FLUSH_INTERVAL = 100
+FILTER_DELAY = 200
+
 COLOR_MAP = {
     'CRITICAL': 'indianred',
-    '   ERROR': 'indianred',
-    ' WARNING': 'khaki',
-    '    INFO': 'lightgray',
+    'ERROR': 'indianred',
+    'WARNING': 'khaki',
+    'INFO': 'lightgray',
 }
 
 
-def append_to_log(widget, text):
-    widget.appendHtml(text)
-    cursor = widget.textCursor()
-    cursor.movePosition(cursor.End)
-    cursor.movePosition(cursor.StartOfLine)
-    widget.setTextCursor(cursor)
-    widget.ensureCursorVisible()
-append_to_log._tkLog = False
+def get_line_limit():
+    try:
+        return max(1, int(os.getenv(LOG_LINES, DEFAULT_LOG_LINES)))
+    except ValueError:
+        return DEFAULT_LOG_LINES
+
+
+def decode_message(message):
+    if isinstance(message, unicode):
+        return message
+    for charset in ("utf-8", 'latin-1', 'iso-8859-1', 'us-ascii', 'windows-1252'):
+        try:
+            return unicode(message, charset)
+        except Exception:
+            continue
+    return u'Unable to decode message'
+
+
+class LogModel(QtCore.QAbstractListModel):
+    """
+    Rows of a LogStore, all of them or the ones matching the current filter.
+    Once the store is full the oldest records are dropped.
+    """
+    def __init__(self, limit, parent=None):
+        super(LogModel, self).__init__(parent)
+        self.store = log_store.LogStore(limit)
+        self._filter = {}
+        # matching sequence numbers, None when unfiltered
+        self._rows = None
+        self._colors = dict((k, QtGui.QColor(v)) for (k, v) in COLOR_MAP.iteritems())
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._rows is None:
+            return len(self.store)
+        return len(self._rows)
+
+    def entry(self, row):
+        if self._rows is None:
+            return self.store.at(row)
+        return self.store.get(self._rows[row])
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            # one line per row, tracebacks are in the tooltip
+            lines = self.entry(index.row()).text.split('\n', 1)
+            if len(lines) > 1:
+                return u'%s  [...]' % lines[0]
+            return lines[0]
+        if role == QtCore.Qt.ToolTipRole:
+            return self.entry(index.row()).text
+        if role == QtCore.Qt.ForegroundRole:
+            return self._colors.get(self.entry(index.row()).levelname)
+        return None
+
+    def set_filter(self, min_level=None, logger=None, text=None):
+        self.beginResetModel()
+        self._filter = dict((k, v) for (k, v) in
+            (('min_level', min_level), ('logger', logger), ('text', text)) if v)
+        if self._filter:
+            self._rows = self.store.query(**self._filter)
+        else:
+            self._rows = None
+        self.endResetModel()
+
+    def extend(self, entries):
+        store = self.store
+        entries = entries[-store.limit:]
+        root = QtCore.QModelIndex()
+
+        overflow = len(store) + len(entries) - store.limit
+        if overflow > 0:
+            if self._rows is None:
+                removed = overflow
+            else:
+                removed = bisect.bisect_left(self._rows, store.first_seq + overflow)
+            if removed:
+                self.beginRemoveRows(root, 0, removed - 1)
+            store.evict(overflow)
+            if self._rows is not None:
+                del self._rows[:removed]
+            if removed:
+                self.endRemoveRows()
+
+        if self._rows is None:
+            start = len(store)
+            self.beginInsertRows(root, start, start + len(entries) - 1)
+            store.extend(entries)
+            self.endInsertRows()
+            return
+
+        matching = [store.matches(e, **self._filter) for e in entries]
+        count = matching.count(True)
+        if count:
+            start = len(self._rows)
+            self.beginInsertRows(root, start, start + count - 1)
+        (added, _) = store.extend(entries)
+        self._rows.extend(seq for (seq, match) in itertools.izip(added, matching) if match)
+        if count:
+            self.endInsertRows()
 
 
 class QtLogHandler(logging.Handler):
-    def __init__(self, widget):
+    def __init__(self, console):
         logging.Handler.__init__(self)
-        self.widget = widget
+        self.console = console
         self.formatter = logging.Formatter("%(asctime)s [%(levelname) 8s] %(message)s")
 
     def emit(self, record):
-        message = self.formatter.format(record)
-        clean = 'Unable to decode message'
-        for charset in ("utf-8", 'latin-1', 'iso-8859-1', 'us-ascii', 'windows-1252'):
-            try:
-                clean = cgi.escape(unicode(message, charset)).encode('ascii', 'xmlcharrefreplace')
-                break
-            except Exception:
-                continue
-
-        for (k, v) in COLOR_MAP.iteritems():
-            if ('[%s]' % k) in clean:
-                clean = '<font color="%s">%s</font>' % (v, clean)
-                break
-        photoshop.callback_event.send_to_main_thread(append_to_log, self.widget, "<pre>%s</pre>" % clean)
+        try:
+            entry = log_store.make_entry(record, decode_message(self.formatter.format(record)))
+        except Exception:
+            self.handleError(record)
+            return
+        # picked up by the console timer, no per record main thread call
+        self.console.pending.append(entry)
 
 
 class LogConsole(QtGui.QWidget):
-    def __init__(self, parent=None):
+    LEVELS = [('All levels', None), ('Debug', logging.DEBUG), ('Info', logging.INFO),
+        ('Warning', logging.WARNING), ('Error', logging.ERROR)]
+    _logger_names = None
+
+    def __init__(self, parent=None, limit=None):
         super(LogConsole, self).__init__(parent)
 
         self.setWindowTitle('Shotgun Photoshop Logs')
         self.layout = QtGui.QVBoxLayout(self)
-        self.logs = QtGui.QPlainTextEdit(self)
+
+        limit = limit or get_line_limit()
+        # filled from any thread, bounded so a hidden console cannot grow
+        self.pending = collections.deque(maxlen=limit)
+        self.model = LogModel(limit, self)
+
+        # filter bar
+        filters = QtGui.QHBoxLayout()
+        self.level = QtGui.QComboBox(self)
+        for (label, level) in self.LEVELS:
+            self.level.addItem(label, level)
+        self.logger = QtGui.QComboBox(self)
+        self.logger.setEditable(True)
+        self.logger.setInsertPolicy(QtGui.QComboBox.NoInsert)
+        self.logger.lineEdit().setPlaceholderText('All loggers')
+        self.logger.setMinimumContentsLength(24)
+        self.search = QtGui.QLineEdit(self)
+        self.search.setPlaceholderText('Search')
+        filters.addWidget(self.level)
+        filters.addWidget(self.logger)
+        filters.addWidget(self.search, 1)
+        self.layout.addLayout(filters)
+
+        # configure the list view, rows are one line each so qt only lays
+        # out and paints the visible ones
+        self.logs = QtGui.QListView(self)
+        self.logs.setModel(self.model)
+        self.logs.setUniformItemSizes(True)
+        self.logs.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+        self.logs.setFont(QtGui.QFont("Courier"))
         self.layout.addWidget(self.logs)
 
-        # configure the text widget
-        self.logs.setLineWrapMode(self.logs.NoWrap)
-        self.logs.setReadOnly(True)
+        # typing restarts the timer so a query runs once typing pauses
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(FILTER_DELAY)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.level.currentIndexChanged.connect(self.apply_filter)
+        self.logger.editTextChanged.connect(self.filter_timer.start)
+        self.search.textChanged.connect(self.filter_timer.start)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(FLUSH_INTERVAL)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
 
         # load up previous size
         self.settings = QtCore.QSettings("Shotgun Software", "tk-photoshop.log_console")
         self.resize(self.settings.value("size", QtCore.QSize(800, 400)))
 
+    def apply_filter(self, *args):
+        self.filter_timer.stop()
+        self.model.set_filter(
+            min_level=self.level.itemData(self.level.currentIndex()),
+            logger=self.logger.currentText().strip() or None,
+            text=self.search.text() or None)
+        self.logs.scrollToBottom()
+
+    def flush(self):
+        entries = []
+        pending = self.pending
+        while pending:
+            entries.append(pending.popleft())
+        if not entries:
+            return
+        scrollbar = self.logs.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        self.model.extend(entries)
+        self._update_loggers()
+        if at_bottom:
+            self.logs.scrollToBottom()
+
+    def _update_loggers(self):
+        names = self.model.store.logger_names()
+        if names == self._logger_names:
+            return
+        self._logger_names = names
+        text = self.logger.currentText()
+        self.logger.blockSignals(True)
+        self.logger.clear()
+        self.logger.addItems(names)
+        self.logger.setEditText(text)
+        self.logger.blockSignals(False)
+
     def closeEvent(self, event):
         self.settings.setValue("size", self.size())
         event.accept()
@@ -15,10 +15,11 @@ Panel handling for Photoshop
 import os
 import sys
 import webbrowser
-import unicodedata
 
 import photoshop
 
+from .command_registry import AppCommand, CommandRegistry
+
 class PanelGenerator(object):
     """
     Panel generation functionality for Photoshop
@@ -26,6 +27,7 @@ class PanelGenerator(object):
     def __init__(self, engine):
         self._engine = engine
         self._dialogs = []
+        self._registry = CommandRegistry(engine)
         engine_root_dir = self._engine.disk_location
 
     ##########################################################################################
@@ -35,46 +37,38 @@ class PanelGenerator(object):
         """
         Render the entire Toolkit panel.
         """
-        # slight hack here but first ensure that the panel is empty
-        photoshop.clear_panel()
+        layout = photoshop.panel.PanelLayout()
 
         # now add the context item on top of the main panel
-        self._add_context_buttons()
+        context_section = self._add_context_buttons(layout)
 
-        # now enumerate all items and create panel objects for them
-        panel_items = []
-        for (cmd_name, cmd_details) in self._engine.commands.items():
-             panel_items.append( AppCommand(cmd_name, cmd_details) )
+        # commands come from the registry, re-indexed only if they changed
+        self._registry.refresh()
+        for cmd in self._registry.by_type("context_menu"):
+            # context menu!
+            cmd.add_button(context_section)
 
-        self._engine.log_debug("panel_items: %s", panel_items)
-
-        # now go through all of the panel items.
-        # separate them out into various sections
+        # normal menus, separated out into one section per app
         commands_by_app = {}
+        for cmd in self._registry.commands():
+            if cmd.get_type() != "context_menu":
+                # un-parented apps go into "Other Items"
+                commands_by_app.setdefault(cmd.get_app_name() or "Other Items", []).append(cmd)
 
-        for cmd in panel_items:
-            if cmd.get_type() == "context_menu":
-                # context menu!
-                cmd.add_button()
-            else:
-                # normal menu
-                app_name = cmd.get_app_name()
-                if app_name is None:
-                    # un-parented app
-                    app_name = "Other Items"
-                if not app_name in commands_by_app:
-                    commands_by_app[app_name] = []
-                commands_by_app[app_name].append(cmd)
+        self._engine.log_debug("panel_items: %s", commands_by_app)
 
         # now add all apps to main panel
-        self._add_app_buttons(commands_by_app)
+        self._add_app_buttons(layout, commands_by_app)
+
+        # the whole panel goes over in one request, rebuilds only send changes
+        photoshop.set_panel(layout)
 
     def destroy_panel(self):
         photoshop.clear_panel()
 
     ##########################################################################################
     # context panel and UI
-    def _add_context_buttons(self):
+    def _add_context_buttons(self, layout):
         """
         Adds a context panel which displays the current context
         """
@@ -84,8 +78,10 @@ class PanelGenerator(object):
         # todo: display context on menu (requires sgtk core 0.12.7+)
 
         # create the panel object
-        photoshop.add_button("Jump to Shotgun", self._jump_to_sg)
-        photoshop.add_button("Jump to File System", self._jump_to_fs)
+        section = layout.add_section("context")
+        section.add_button("Jump to Shotgun", self._jump_to_sg)
+        section.add_button("Jump to File System", self._jump_to_fs)
+        return section
 
 
     def _jump_to_sg(self):
@@ -124,7 +120,7 @@ class PanelGenerator(object):
 
     ##########################################################################################
     # app panels
-    def _add_app_buttons(self, commands_by_app):
+    def _add_app_buttons(self, layout, commands_by_app):
         """
         Add all apps to the main panel, process them one by one.
         """
@@ -132,73 +128,14 @@ class PanelGenerator(object):
             if len(commands_by_app[app_name]) > 1:
                 # more than one panel entry fort his app
                 # make a sub panel and put all items in the sub panel
+                section = layout.add_section("app:%s" % app_name, app_name)
                 for cmd in commands_by_app[app_name]:
-                    cmd.add_button()
+                    cmd.add_button(section)
             else:
                 # this app only has a single entry.
                 # display that on the panel
                 # todo: Should this be labelled with the name of the app
                 # or the name of the panel item? Not sure.
+                section = layout.add_section("app:%s" % app_name)
                 cmd_obj = commands_by_app[app_name][0]
-                cmd_obj.add_button()
-
-
-class AppCommand(object):
-    """
-    Wraps around a single command that you get from engine.commands
-    """
-    def __init__(self, name, command_dict):
-        self.name = name
-        self.properties = command_dict["properties"]
-        self.callback = command_dict["callback"]
-
-    def get_app_name(self):
-        """
-        Returns the name of the app that this command belongs to
-        """
-        if "app" in self.properties:
-            return self.properties["app"].display_name
-        return None
-
-    def get_app_instance_name(self):
-        """
-        Returns the name of the app instance, as defined in the environment.
-        Returns None if not found.
-        """
-        if "app" not in self.properties:
-            return None
-
-        app_instance = self.properties["app"]
-        engine = app_instance.engine
-
-        for (app_instance_name, app_instance_obj) in engine.apps.items():
-            if app_instance_obj == app_instance:
-                # found our app!
-                return app_instance_name
-        return None
-
-    def get_documentation_url_str(self):
-        """
-        Returns the documentation as a str
-        """
-        if "app" in self.properties:
-            app = self.properties["app"]
-            doc_url = app.documentation_url
-            # deal with nuke's inability to handle unicode. #fail
-            if doc_url.__class__ == unicode:
-                doc_url = unicodedata.normalize('NFKD', doc_url).encode('ascii', 'ignore')
-            return doc_url
-
-        return None
-
-    def get_type(self):
-        """
-        returns the command type. Returns node, custom_pane or default
-        """
-        return self.properties.get("type", "default")
-
-    def add_button(self):
-        """
-        Adds an app command to the panel
-        """
-        photoshop.add_button(self.name, self.callback)
+                cmd_obj.add_button(section)